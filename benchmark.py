@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+
+import detect_meteor
+import lighten_only_composite
+import make_digest_movie
+import rectutil
+import synthetic
+import config
+import version
+
+args = None
+
+# detect_meteor.py にそのまま渡すオプション
+DETECT_OPTIONS = ("area_threshold", "area_value_threshold", "area_reuse_frames",
+                  "line_threshold", "min_line_length", "max_line_gap",
+                  "hough_threshold", "background_threshold", "stack_frames",
+                  "marker_color", "marker_thickness", "memory_budget")
+
+SCHEMA = config.Schema(
+    # synthetic video
+    config.Option("width", int, 1920, minimum=1),
+    config.Option("height", int, 1080, minimum=1),
+    config.Option("fps", float, 30, minimum=1),
+    config.Option("frames", int, 300, minimum=1),
+    config.Option("stars", int, 1000, minimum=0),
+    config.Option("meteors", int, 5, minimum=0),
+    config.Option("noise", float, 3.0, minimum=0.0),
+    config.Option("moon", bool, False),
+    config.Option("clouds", bool, False),
+    config.Option("seed", int, 0),
+    # detect_meteor.py
+    config.DETECTION_OPTIONS,
+    config.MARKER_OPTIONS,
+    config.Option("memory-budget", int, 0, minimum=0,
+                  help="MiB. 0: unlimited."),
+    # benchmark
+    config.Option("skip-composite", bool, False),
+    config.Option("skip-digest", bool, False),
+    config.Option("work-directory", str, None,
+                  help="keep generated files in this directory."),
+    config.Option("output-file", str, None,
+                  help="write the report as JSON."),
+)
+
+STAGES = ("decode", "stack", "area", "threshold", "hough", "snapshot", "json")
+
+def evaluate(detections, truth, stack_size):
+    """
+    検出結果と正解データの照合
+    検出フレームから `stack_size` フレームの間に流星が出現していて、
+    検出した直線が流星の経路と重なっていれば正しい検出とする
+    :return: 評価結果
+    """
+    meteors = truth['meteors']
+    recalled = [False] * len(meteors)
+    true_positive = 0
+    for d in detections:
+        start = d['frame']
+        end = start + stack_size
+        rects = [rectutil.line_rect(line, 2) for line in d['lines']]
+        matched = False
+        for k, m in enumerate(meteors):
+            if m['start_frame'] < end and start < m['end_frame'] and \
+               any(rectutil.intersects(r, m['rect']) for r in rects):
+                recalled[k] = True
+                matched = True
+        if matched:
+            true_positive += 1
+    return {
+        'meteors': len(meteors),
+        'detections': len(detections),
+        'true_positive': true_positive,
+        'recall': sum(recalled) / len(meteors) if meteors else 1.0,
+        'precision': true_positive / len(detections) if detections else 1.0,
+    }
+
+def run_tool(main_func, argv):
+    """
+    各コマンドの main() を同じプロセス内で実行して経過時間を計測
+    """
+    start = time.perf_counter()
+    ret = main_func(argv)
+    elapsed = time.perf_counter() - start
+    if ret:
+        raise RuntimeError("{} failed: {}".format(argv[0], ret))
+    return elapsed
+
+def count_frames(video_file):
+    cap = cv2.VideoCapture(video_file)
+    count = 0
+    while cap.grab():
+        count += 1
+    cap.release()
+    return count
+
+def fps(frames, elapsed):
+    return frames / elapsed if elapsed > 0 else float('inf')
+
+def benchmark(work_directory):
+    report = {
+        'settings': {
+            'width': args.width,
+            'height': args.height,
+            'fps': args.fps,
+            'frames': args.frames,
+            'meteors': args.meteors,
+            'noise': args.noise,
+            'moon': args.moon,
+            'clouds': args.clouds,
+            'seed': args.seed,
+        }
+    }
+
+    print("generating synthetic video: {}x{} {} frames".format(
+        args.width, args.height, args.frames))
+    sky = synthetic.SyntheticSky(args.width, args.height, fps=args.fps,
+                                 frames=args.frames, stars=args.stars,
+                                 meteors=args.meteors, noise=args.noise,
+                                 moon=args.moon, clouds=args.clouds,
+                                 seed=args.seed)
+    video_file = os.path.join(work_directory, "synthetic.mov")
+    sky.write_video(video_file)
+    truth = sky.ground_truth()
+    with open(os.path.join(work_directory, "synthetic_truth.json"), mode='w') as f:
+        json.dump(truth, f, indent=2)
+
+    # detect_meteor.py
+    metrics_file = os.path.join(work_directory, "metrics.json")
+    detect_argv = ["detect_meteor.py", video_file,
+                   "--output-directory", work_directory,
+                   "--metrics-file", metrics_file]
+    for name in DETECT_OPTIONS:
+        detect_argv += ["--" + name.replace('_', '-'),
+                        str(getattr(args, name))]
+    run_tool(detect_meteor.main, detect_argv)
+    with open(metrics_file) as f:
+        m = json.load(f)
+    result_file = os.path.join(work_directory, "result_synthetic.mov.json")
+    with open(result_file) as f:
+        detections = json.load(f)
+    frames = m['counters'].get('frames', 0)
+    stages = {}
+    for stage in STAGES:
+        elapsed = m['stages'].get(stage, {}).get('sum', 0.0)
+        stages[stage] = {'seconds': elapsed, 'fps': fps(frames, elapsed)}
+    report['detect_meteor'] = {
+        'frames': frames,
+        'seconds': m['wall_seconds'],
+        'cpu_seconds': m['cpu_seconds'],
+        'fps': fps(frames, m['wall_seconds']),
+        'stages': stages,
+        'evaluation': evaluate(detections, truth, args.stack_frames),
+    }
+
+    # lighten_only_composite.py
+    if not args.skip_composite:
+        elapsed = run_tool(lighten_only_composite.main,
+                           ["lighten_only_composite.py", video_file,
+                            os.path.join(work_directory, "composite.png")])
+        report['lighten_only_composite'] = {
+            'frames': args.frames,
+            'seconds': elapsed,
+            'fps': fps(args.frames, elapsed),
+        }
+
+    # make_digest_movie.py
+    if not args.skip_digest and detections:
+        elapsed = run_tool(make_digest_movie.main,
+                           ["make_digest_movie.py", result_file,
+                            "--output-directory", work_directory])
+        frames = count_frames(os.path.join(work_directory,
+                                           "result_synthetic.mov.mp4"))
+        report['make_digest_movie'] = {
+            'frames': frames,
+            'seconds': elapsed,
+            'fps': fps(frames, elapsed),
+        }
+
+    return report
+
+def print_report(report):
+    d = report['detect_meteor']
+    print("")
+    print("detect_meteor: {} frames, {:.2f} s (cpu {:.2f} s), {:.1f} fps".format(
+        d['frames'], d['seconds'], d['cpu_seconds'], d['fps']))
+    for stage in STAGES:
+        s = d['stages'][stage]
+        print("  {:<10} {:8.3f} s {:10.1f} fps".format(stage, s['seconds'],
+                                                        s['fps']))
+    e = d['evaluation']
+    print("  recall:    {:.3f} ({} meteors)".format(e['recall'], e['meteors']))
+    print("  precision: {:.3f} ({}/{} detections)".format(
+        e['precision'], e['true_positive'], e['detections']))
+    for name in ('lighten_only_composite', 'make_digest_movie'):
+        if name in report:
+            r = report[name]
+            print("{}: {} frames, {:.2f} s, {:.1f} fps".format(
+                name, r['frames'], r['seconds'], r['fps']))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=version.version_string(__file__))
+    SCHEMA.add_arguments(parser)
+    parser.add_argument("--config-file", default=None)
+    parser.add_argument("--profile", default=None,
+                        help="profile name in the config file.")
+    global args
+    try:
+        _, args = SCHEMA.parse_args(parser, argv[1:])
+    except config.ConfigError as err:
+        print("ERROR: " + err.message, file=sys.stderr)
+        return -1
+
+    work_directory = args.work_directory
+    if work_directory is None:
+        work_directory = tempfile.mkdtemp(prefix="smd-benchmark-")
+    elif not os.path.exists(work_directory):
+        os.makedirs(work_directory)
+
+    try:
+        report = benchmark(work_directory)
+    finally:
+        if args.work_directory is None:
+            shutil.rmtree(work_directory)
+
+    print_report(report)
+    if args.output_file:
+        with open(args.output_file, mode='w') as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,343 @@
+import argparse
+import copy
+import hashlib
+import json
+import sys
+import typing
+
+import colorparse
+
+class ConfigError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+def color(value) -> typing.Tuple[int, ...]:
+    """
+    色の値の変換（`'(B,G,R)'`・`'(B,G,R,A)'` 形式の文字列またはリスト）
+    """
+    if isinstance(value, (list, tuple)):
+        value = "(" + ",".join(str(v) for v in value) + ")"
+    try:
+        return colorparse.parse(str(value))
+    except (colorparse.ColorFormatError, colorparse.ColorValueError) as err:
+        raise ConfigError(err.message)
+
+def threshold_or_auto(value) -> typing.Optional[float]:
+    """
+    閾値の変換（`'auto'` の場合は None）
+    """
+    if value is None or value == 'auto':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return float(value)
+
+
+class Option:
+    """
+    設定項目の定義
+    コマンドラインオプション `--name` と設定ファイルの `name` に対応する
+    :param str name: 名前（先頭の `--` を除いたオプション名）
+    :param type: 値の型（`int`・`float`・`str`・`bool`（フラグ）または変換関数）
+    :param default: デフォルト値
+    :param choices: 選択肢
+    :param minimum: 最小値
+    :param maximum: 最大値
+    :param str help: コマンドラインのヘルプ
+    :param str unless: この名前のフラグが指定された場合は値を検証せず None にする
+                       （無効にした機能の設定項目に仮の値が書かれていてもエラーにしない）
+    """
+    def __init__(self, name: str, type=str, default=None, choices=None,
+                 minimum=None, maximum=None, help: typing.Optional[str] = None,
+                 unless: typing.Optional[str] = None):
+        self.name = name
+        self.dest = name.replace('-', '_')
+        self.type = type
+        self.default = default
+        self.choices = choices
+        self.minimum = minimum
+        self.maximum = maximum
+        self.help = help
+        self.unless = unless
+
+    def add_argument(self, parser: argparse.ArgumentParser):
+        # 指定されなかったオプションは Namespace に入れず、設定ファイルの値と区別する
+        kwargs = {'default': argparse.SUPPRESS}
+        if self.help:
+            kwargs['help'] = self.help
+        if self.type is bool:
+            kwargs['action'] = "store_true"
+        else:
+            if self.type in (int, float):
+                kwargs['type'] = self.type
+            if self.choices:
+                kwargs['choices'] = self.choices
+        parser.add_argument("--" + self.name, **kwargs)
+
+    def convert(self, value, source: str):
+        """
+        値の検証と変換
+        :param value: 値（コマンドラインの文字列または設定ファイルの値）
+        :param str source: 値の出所（エラーメッセージ用）
+        :return: 変換した値
+        """
+        def invalid():
+            return ConfigError("invalid value for {} in {}: {!r}".format(
+                self.name, source, value))
+        if value is None:
+            if self.default is None:
+                return None
+            raise invalid()
+        if self.type is bool:
+            if not isinstance(value, bool):
+                raise invalid()
+            return value
+        if self.type in (int, float) and isinstance(value, bool):
+            raise invalid()
+        if self.type is int and isinstance(value, float):
+            if not value.is_integer():
+                raise invalid()
+            value = int(value)
+        try:
+            result = self.type(value)
+        except ConfigError as err:
+            raise ConfigError("{} in {}: {}".format(self.name, source,
+                                                    err.message))
+        except (AttributeError, TypeError, ValueError):
+            raise invalid()
+        if self.choices and result not in self.choices:
+            raise ConfigError("invalid value for {} in {}: {!r} (choose from {})".format(
+                self.name, source, value, ", ".join(map(str, self.choices))))
+        if result is not None:
+            if self.minimum is not None and result < self.minimum:
+                raise ConfigError("{} must be >= {} in {}: {!r}".format(
+                    self.name, self.minimum, source, value))
+            if self.maximum is not None and result > self.maximum:
+                raise ConfigError("{} must be <= {} in {}: {!r}".format(
+                    self.name, self.maximum, source, value))
+        return result
+
+
+class Config:
+    """
+    検証済みの設定（変更不可）
+    値は属性（`config.marker_color`）または名前（`config['marker-color']`）で参照する
+    プロセス間で受け渡せるように pickle できる
+    :param dict values: `dest` 名（`_` 区切り）をキーとする値
+    """
+    __slots__ = ("_values",)
+
+    def __init__(self, values: dict):
+        object.__setattr__(self, "_values", dict(values))
+
+    def __getattr__(self, name: str):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError("Config is immutable")
+
+    def __getitem__(self, name: str):
+        return self._values[name.replace('-', '_')]
+
+    def __contains__(self, name: str) -> bool:
+        return name.replace('-', '_') in self._values
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Config) and self._values == other._values
+
+    def __hash__(self) -> int:
+        return hash(self.digest())
+
+    def __reduce__(self):
+        return (Config, (self._values,))
+
+    def __repr__(self) -> str:
+        return "Config({!r})".format(self._values)
+
+    def get(self, name: str, default=None):
+        return self._values.get(name.replace('-', '_'), default)
+
+    def replace(self, **values) -> "Config":
+        """
+        一部の値を変更した設定の作成
+        """
+        new_values = dict(self._values)
+        new_values.update(values)
+        return Config(new_values)
+
+    def to_dict(self) -> dict:
+        """
+        設定ファイルと同じ形式（オプション名をキーとする JSON の値）への変換
+        """
+        result = {}
+        for k, v in self._values.items():
+            if isinstance(v, tuple):
+                v = str(v)
+            result[k.replace('_', '-')] = v
+        return result
+
+    def digest(self, names: typing.Optional[typing.Iterable[str]] = None) -> str:
+        """
+        設定のハッシュ値（検出結果のキャッシュのキーなどに使う）
+        :param names: 対象にする名前（None の場合はすべて）
+        :return: SHA-256 の16進文字列
+        """
+        d = self.to_dict()
+        if names is not None:
+            keys = {n.replace('_', '-') for n in names}
+            d = {k: v for k, v in d.items() if k in keys}
+        text = json.dumps(d, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class Schema:
+    """
+    設定項目の一覧
+    コマンドラインオプションの登録と、デフォルト値・設定ファイル・プロファイル・
+    コマンドラインの値の統合（後のものが優先）を行う
+    :param options: `Option` またはそのリスト
+    """
+    def __init__(self, *options):
+        self.options = {}
+        for o in options:
+            for option in (o if isinstance(o, (list, tuple)) else [o]):
+                self.options[option.name] = option
+
+    def add_arguments(self, parser: argparse.ArgumentParser):
+        for option in self.options.values():
+            option.add_argument(parser)
+
+    def defaults(self) -> Config:
+        return self.resolve({})
+
+    def _apply(self, raw: dict, data: dict, source: str):
+        for name, value in data.items():
+            option = self.options.get(name)
+            if option is None:
+                # 他のコマンドの設定項目と共有する設定ファイルもあるので無視する
+                print("WARNING: unknown option in {}: {}".format(source, name),
+                      file=sys.stderr)
+                continue
+            raw[option.name] = (value, source)
+
+    def resolve(self, given: dict, config_file: typing.Optional[str] = None,
+                profile: typing.Optional[str] = None) -> Config:
+        """
+        設定の統合
+        :param dict given: コマンドラインで指定された値（`dest` 名をキーとする）
+        :param str config_file: 設定ファイルパス
+        :param str profile: 設定ファイルの `profiles` から選ぶプロファイル名
+        :return: 検証済みの設定
+        """
+        # 値は出所と共に集めてから検証する（`unless` のフラグが後から指定される場合があるため）
+        raw = {}
+        for option in self.options.values():
+            raw[option.name] = (option.default, "defaults")
+        if config_file:
+            data = load_file(config_file)
+            profiles = data.pop('profiles', {})
+            self._apply(raw, data, config_file)
+            if profile:
+                if profile not in profiles:
+                    raise ConfigError("profile not found in {}: {}".format(
+                        config_file, profile))
+                self._apply(raw, profiles[profile],
+                            "{} (profile {})".format(config_file, profile))
+        elif profile:
+            raise ConfigError("profile requires a config file: " + profile)
+        by_dest = {o.dest: o for o in self.options.values()}
+        for dest, value in given.items():
+            option = by_dest.get(dest)
+            if option is not None:
+                raw[option.name] = (value, "command line")
+        values = {}
+        for option in sorted(self.options.values(),
+                             key=lambda o: o.unless is not None):
+            value, source = raw[option.name]
+            if option.unless is not None and \
+               values.get(self.options[option.unless].dest):
+                values[option.dest] = None
+            elif value is None and source == "defaults":
+                values[option.dest] = None
+            else:
+                values[option.dest] = option.convert(value, source)
+        return Config({o.dest: values[o.dest] for o in self.options.values()})
+
+    def parse_args(self, parser: argparse.ArgumentParser, argv: typing.List[str],
+                   config_file_dest: str = "config_file",
+                   profile_dest: str = "profile") -> typing.Tuple[argparse.Namespace, Config]:
+        """
+        コマンドラインの解析と設定の統合
+        :param parser: `add_arguments()` で設定項目を登録したパーサ
+        :param argv: コマンドライン引数（コマンド名を除く）
+        :param str config_file_dest: 設定ファイルを指定するオプションの `dest` 名
+        :param str profile_dest: プロファイルを指定するオプションの `dest` 名
+        :return: (設定項目以外の引数, 設定)
+        """
+        args = parser.parse_args(argv)
+        given = {}
+        for option in self.options.values():
+            if hasattr(args, option.dest):
+                given[option.dest] = getattr(args, option.dest)
+                delattr(args, option.dest)
+        config = self.resolve(given, getattr(args, config_file_dest, None),
+                              getattr(args, profile_dest, None))
+        return args, config
+
+
+def load_file(config_file: str) -> dict:
+    """
+    設定ファイル（JSON）の読み込み
+    """
+    try:
+        with open(config_file) as f:
+            data = json.load(f)
+    except OSError as err:
+        raise ConfigError("cannot read config file: {}".format(err))
+    except ValueError as err:
+        raise ConfigError("invalid config file {}: {}".format(config_file, err))
+    if not isinstance(data, dict):
+        raise ConfigError("invalid config file: " + config_file)
+    return data
+
+
+def unless(flag: str, option: Option) -> Option:
+    """
+    共通の設定項目を、フラグが指定された場合は検証しない設定項目にしたもの
+    :param str flag: フラグの名前（`disable-marker` など）
+    :param Option option: 設定項目
+    :return: 設定項目のコピー
+    """
+    result = copy.copy(option)
+    result.unless = flag
+    return result
+
+
+# 各コマンドで共通の設定項目
+
+DETECTION_OPTIONS = [
+    Option("area-threshold", float, 0.0, minimum=0.0, maximum=1.0),
+    Option("area-value-threshold", int, 127, minimum=0, maximum=255),
+    Option("area-reuse-frames", int, 1, minimum=1),
+    Option("line-threshold", float, 21),
+    Option("min-line-length", float, 21),
+    Option("max-line-gap", float, 5),
+    Option("hough-threshold", int, 0),
+    Option("background-threshold", int, 25, minimum=0, maximum=255),
+    Option("stack-frames", int, 5, minimum=1),
+]
+
+MARKER_OPTIONS = [
+    Option("marker-color", color, "(0,255,0)",
+           help="'(B,G,R)' or '(B,G,R,A)' format."),
+    Option("marker-thickness", int, 1),
+]
+
+METRICS_OPTIONS = [
+    Option("metrics-file", str, None,
+           help="write per-stage timings to this file ('-' for stdout)."),
+    Option("metrics-format", str, "json", choices=("json", "prometheus")),
+]
@@ -1,26 +1,47 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
-import math
 import os
 import sys
 import typing
 import datetime
 import json
+import time
 
-import cv2
-import numpy
-import ffmpeg
-from PIL import Image
-import PIL.ExifTags as ExifTags
-from tqdm import tqdm
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+numpy = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+tqdm = lazy_import('tqdm')
+# 読み込み時に numpy の dtype を作るので、結果の保存時まで読み込まない
+resultstore = lazy_import('resultstore')
 
-import colorparse
 import rgbadraw
-import argutil
+import rectutil
+import config
+import detector
+import memprofile
+import pngwriter
+import metrics
+import videosource
 import version
 
-args = None
+SCHEMA = config.Schema(
+    config.DETECTION_OPTIONS,
+    config.Option("decoder", str, "opencv", choices=videosource.DECODERS),
+    config.Option("decoder-threads", int, 0, minimum=0, help="0: auto."),
+    config.Option("frame-step", int, 1, minimum=1),
+    config.MARKER_OPTIONS,
+    config.Option("output-directory", str, '.'),
+    config.Option("memory-profile", bool, False,
+                  help="report the transient memory peak per frame."),
+    config.Option("memory-budget", int, 0, minimum=0,
+                  help="MiB. process frames in strips to fit. 0: unlimited."),
+    config.METRICS_OPTIONS,
+    config.Option("result-format", str, "json", choices=("json", "npz")),
+)
 
 def load_gray(filepath: str) -> numpy.array:
     """
@@ -32,209 +53,202 @@ def load_gray(filepath: str) -> numpy.array:
     img = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
     return img
 
-def detect_lines(img: numpy.array) -> typing.List[numpy.array]:
-    """
-    直線検出
-    :param numpy.array img: 入力画像（グレイスケール）
-    :return: 検出直線リスト, 輪郭画像
-    """
-    ret, thr = cv2.threshold(img, args.background_threshold, 255,
-                           cv2.ADAPTIVE_THRESH_MEAN_C)
-    lines = cv2.HoughLinesP(thr, rho=1, theta=math.pi/180,
-                            threshold=args.hough_threshold,
-                            minLineLength=args.min_line_length,
-                            maxLineGap=args.max_line_gap)
-    return lines, thr
-
-
-def detect_area(img: numpy.array, threshold: float = 0.0001,
-                value_threshold: int = 127) -> typing.List[numpy.array]:
+def save_snapshot(filepath: str, timg: numpy.array, lines,
+                  marker_color, marker_thickness: int, strip_rows: int = 0):
     """
-    閾値を超える面積を持つ輪郭の検出
-    :param numpy.array img: 入力画像
-    :param float threshold: 閾値（画像全体の何%を`(0, 1]`で指定）
-    :param int value_threshold: ピクセル値の閾値を `(0-255)`で指定）
-    :return: 閾値を超えた面積の領域リスト
+    スナップショット画像（二値化画像にマーカーを描画したもの）の保存
+    :param str filepath: 出力ファイルパス
+    :param numpy.array timg: 二値化画像
+    :param lines: 検出した直線リスト
+    :param marker_color: マーカーの色
+    :param int marker_thickness: マーカーの線の太さ
+    :param int strip_rows: カラー画像をストリップ毎に作って PNG に書き出す場合の行数
+                           （0 の場合は画像全体のカラー画像を作る）
     """
-    height, width = img.shape
-    img_area = width * height
-    ret, thr = cv2.threshold(img, value_threshold, 255,
-                             cv2.ADAPTIVE_THRESH_MEAN_C)
-    _, contours, hierarchy = cv2.findContours(thr, 1, 2)
-    contours = [cnt for cnt in contours if (cv2.contourArea(cnt) / img_area) > threshold]
-    return contours
-
-
-T = typing.TypeVar("T")
-def clamp(v: T, min_v: T, max_v: T) -> T:
-    """
-    clamp関数
-    入力値を`[min_v, max_v]`の範囲に収める
-    :param T v: 入力値
-    :param T min_v: 最小値
-    :param T max_v: 最大値
-    :return: `[min_v, max_v]`内に収めた値
-    """
-    return min(max_v, max(v, min_v))
-
-
-def fill_area(img: numpy.array, contours: typing.List[numpy.array], buffer_ratio: float = 0.01, color: typing.Optional[float] = None) -> numpy.array:
-    """
-    領域の外接矩形で塗りつぶす
-    :param numpy.array img: 入力画像
-    :param contours: 領域リスト
-    :param float buffer_ratio: バッファ率 (e.g. 6000 * 0.01 => 60px)
-    :param float color: 塗りつぶしの色（未指定の場合は入力画像の中央値で塗りつぶす）
-    :return: 塗りつぶし後の画像
-    """
-    height, width = img.shape
-    x_buffer = int(width * buffer_ratio)
-    y_buffer = int(height * buffer_ratio)
-    # detect fill color
-    if color is None:
-        color = numpy.median(img)
-    # fill bounding rect
-    for cnt in contours:
-        x, y, w, h = cv2.boundingRect(cnt)
-        left = clamp(x - x_buffer, 0, width)
-        top = clamp(y - y_buffer, 0, height)
-        right = clamp(x + w + x_buffer, 0, width)
-        bottom = clamp(y + h + y_buffer, 0, height)
-        pts = numpy.asarray([
-            [left, top],
-            [left, bottom],
-            [right, bottom],
-            [right, top],
-        ])
-        img = cv2.fillPoly(img, pts=[pts], color=(color,))
-    return img
-
-
-def line_length(line: numpy.array) -> float:
+    rects = rectutil.marker_rects(lines, marker_thickness)
+    if strip_rows <= 0 or not filepath.lower().endswith(".png"):
+        def draw_marker(img, color):
+            for line in lines:
+                x1,y1,x2,y2 = line[0]
+                cv2.rectangle(img, (x1,y1), (x2,y2), color, marker_thickness)
+        cimg = cv2.cvtColor(timg, cv2.COLOR_GRAY2RGB)
+        cv2.imwrite(filepath, rgbadraw.draw(cimg, marker_color, draw_marker, rects))
+        return
+    height, width = timg.shape[:2]
+    with pngwriter.PNGWriter(filepath, width, height) as writer:
+        for y in range(0, height, strip_rows):
+            # ストリップの座標に平行移動して描画する
+            def draw_marker(img, color):
+                for line in lines:
+                    x1,y1,x2,y2 = line[0]
+                    cv2.rectangle(img, (x1,y1-y), (x2,y2-y), color,
+                                  marker_thickness)
+            cimg = cv2.cvtColor(timg[y : y + strip_rows], cv2.COLOR_GRAY2RGB)
+            strip_rects = [(x, ry - y, w, h) for x, ry, w, h in rects]
+            writer.write(rgbadraw.draw(cimg, marker_color, draw_marker,
+                                       strip_rects))
+
+# スナップショットをストリップ毎に作る場合に使うメモリ（ストリップの1画素あたり）:
+# カラー画像 3 + PNG の行データ 3
+SNAPSHOT_BYTES_PER_PIXEL = 6
+
+def plan_memory_budget(meteor_detector: detector.Detector, memory_budget: int,
+                       shape: typing.Tuple[int, int], planes: float = 0):
     """
-    直線の長さの算出
-    `cv2.HoughLinesP()`の返り値は`[ [ [start_x, start_y, end_x, end_y] ], ... ]`形式になっている
-    :param line: `[ [start_x, start_y, end_x, end_y] ]`であること
-    :return: 直線の長さ
+    メモリ予算（`--memory-budget`）に収まるストリップの行数の設定
+    予算からその時点のメモリ使用量（デコーダや比較明合成のバッファを含む）と
+    これから確保されるバッファを除いた分に、画像全体の処理（スナップショットの
+    カラー画像を含む）が収まらない場合は、面積のある領域の検出とスナップショットの
+    作成をストリップ毎に行わせる。それでも収まらない場合は直線検出もストリップ毎に行わせる
+    :param detector.Detector meteor_detector: 検出器
+    :param int memory_budget: プロセス全体のメモリ予算（MiB）
+    :param shape: 入力画像のサイズ `(height, width)`
+    :param float planes: これから確保されるバッファの量（グレイスケールの入力画像何枚分か）
     """
-    assert len(line) == 1
-    sx, sy, ex, ey = line[0]
-    dx = ex - sx
-    dy = ey - sy
-    return math.sqrt(dx * dx + dy * dy)
-
+    height, width = shape[:2]
+    used = memprofile.current_rss() or memprofile.peak_rss() or 0
+    available = memory_budget * memprofile.MIB - used - \
+        int(planes * width * height)
+    area = meteor_detector.params.area_threshold > 0.0
+    overlap = meteor_detector.overlap_rows()
+    rows = 0
+    hough_strips = False
+    if detector.estimate_memory(shape, area) + 3 * width * height > available:
+        # 直線検出は画像全体に対して行えるか（検出結果がストリップに分けない場合と同じになる）
+        for hough_strips in (False, True):
+            rows = detector.plan_strip_rows(shape, available, area, overlap,
+                                            SNAPSHOT_BYTES_PER_PIXEL,
+                                            hough_strips)
+            # 予算に余裕があっても少なくとも2つに分ける
+            rows = min(rows, (height + 1) // 2)
+            estimate = detector.estimate_memory(shape, area, rows, overlap,
+                                                hough_strips) + \
+                SNAPSHOT_BYTES_PER_PIXEL * width * rows
+            if estimate <= available:
+                break
+        else:
+            print("WARNING: memory budget is too small for {}x{} frames: "
+                  "{:.0f} MiB more required.".format(
+                      width, height, (estimate - available) / memprofile.MIB),
+                  file=sys.stderr)
+    meteor_detector.strip_rows = rows
+    meteor_detector.hough_strips = hough_strips
+    if not rows:
+        strips = "none"
+    elif hough_strips:
+        strips = "{} rows (line detection in strips, overlap {})".format(
+            rows, overlap)
+    else:
+        strips = "{} rows".format(rows)
+    print("memory budget: {} MiB, in use: {:.0f} MiB, strips: {}".format(
+        memory_budget, used / memprofile.MIB, strips))
 
-def detect_meteor(img: numpy.array, area_threshold: float,
-                  area_value_threshold: int,
-                  line_threshold: float) -> typing.Optional[typing.Tuple[str, typing.List[numpy.array]]]:
+def print_peak_memory():
     """
-    流星の検出
-    :param numpy.array img: 入力画像
-    :param float area_threshold: 面積のある領域検知用閾値（`detect_area()`関数`threshold`参照）
-    :param int area_value_threshold: ピクセル値の閾値を `(0-255)`で指定）
-    :param float line_threshold: 検出した直線を流星と判定する最小の長さ
-    :return: (画像ファイルパス, 検出した直線) or None, 輪郭画像 or None
+    最大メモリ使用量の表示
     """
-    if area_threshold > 0.0:
-        area_contours = detect_area(img, area_threshold, area_value_threshold)
-        if area_contours:
-            img = fill_area(img, area_contours)
-    lines, timg = detect_lines(img)
-    if lines is not None:
-        length = max([line_length(x) for x in lines])
-        if length > line_threshold:
-            return lines, timg
-    return None, None
+    peak = memprofile.peak_rss()
+    if peak is not None:
+        print("peak memory (RSS): {:.1f} MiB".format(peak / memprofile.MIB))
+    # ffmpeg でデコードした場合はサブプロセスのメモリも別に必要
+    peak = memprofile.peak_rss(children=True)
+    if peak:
+        print("peak memory of subprocesses (RSS): {:.1f} MiB".format(
+            peak / memprofile.MIB))
 
 class VideoFrames:
-    def __init__(self, video_file, stack_size):
-        video_info = ffmpeg.probe(video_file)
-        self.video_creation_time = video_info['streams'][0]['tags']['creation_time']
-        self.cap = cv2.VideoCapture(video_file)
+    def __init__(self, video_file, stack_size, metrics=metrics.NULL,
+                 decoder="opencv", threads=0, frame_step=1):
+        self.info = videosource.probe(video_file)
+        self.video_creation_time = self.info.creation_time
+        self.decoder = videosource.open_decoder(video_file, decoder,
+                                                self.info, threads=threads,
+                                                frame_step=frame_step)
         self.video_file = video_file
         self.stack_size = stack_size
+        self.frame_step = frame_step
+        self.metrics = metrics
         self.timestamps = []
 
     def __iter__(self):
         return VideoFrameIterator(self)
 
     def add_timestamp(self):
-        self.timestamps.append(self.cap.get(cv2.CAP_PROP_POS_MSEC))
+        self.timestamps.append(self.decoder.timestamp)
 
     def timedelta(self, i):
         return datetime.timedelta(milliseconds=self.timestamps[i])
 
     def creation_time(self, i):
         return self.video_creation_time
+
+    def frame_number(self, i):
+        return i * self.frame_step
         
     def filepath(self, i):
         return str(self.video_file)
 
     def length(self):
-        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return (self.info.frame_count + self.frame_step - 1) // self.frame_step
+
+    def close(self):
+        self.decoder.release()
 
 class VideoFrameIterator:
     def __init__(self, vf):
         self.vf = vf
-        self.cap = vf.cap
-        self.frames = [None] * vf.stack_size
+        self.decoder = vf.decoder
+        self.metrics = vf.metrics
+        self.stacker = detector.FrameStacker(vf.stack_size)
+        self.shape = None
         self.frame_count = 0
-        self.pos = 0
         self.eof = False
 
     def __iter__(self):
         return self
 
+    def _read(self):
+        # 2フレーム目以降は比較明合成用のバッファに直接デコードする
+        slot = self.stacker.slot(self.shape) if self.shape else None
+        with self.metrics.stage("decode"):
+            frame = self.decoder.read(slot)
+        if frame is None:
+            self.eof = True
+            return False
+        if frame is slot:
+            self.stacker.advance()
+        else:
+            self.shape = frame.shape[:2]
+            self.stacker.push(frame)
+        self.frame_count += 1
+        self.vf.add_timestamp()
+        return True
+
     def __next__(self):
         if self.eof:
             raise StopIteration
         
         if self.frame_count == 0:
-            for i in range(0, len(self.frames)):
-                result, frame = self.cap.read()
-                if result:
-                    self.frame_count += 1
-                    self.vf.add_timestamp()
-                    self.frames[i] = frame
-                else:
-                    self.eof = True
-        else:
-            result, frame = self.cap.read()
-            if result:
-                self.frame_count += 1
-                self.vf.add_timestamp()
-                self.frames[self.pos] = frame
-                self.pos += 1
-                if (self.pos >= len(self.frames)):
-                    self.pos = 0
-            else:
-                self.eof = True
+            for i in range(0, self.stacker.stack_size):
+                if not self._read():
+                    break
+            if self.frame_count == 0:
                 raise StopIteration
+        elif not self._read():
+            raise StopIteration
         
-        return self._stack_frames()
-
-    def _stack_frames(self):
-        result = None
-        for f in self.frames:
-            if f is None:
-                break
-            if result is None:
-                result = cv2.cvtColor(f, cv2.COLOR_RGB2GRAY)
-            else:
-                # グレースケール画像に変換
-                f = cv2.cvtColor(f, cv2.COLOR_RGB2GRAY)
-                # 比較明合成
-                result = numpy.maximum(f, result)
-        return result
+        with self.metrics.stage("stack"):
+            return self.stacker.stacked()
 
 class PhotoList:
-    def __init__(self, dir):
+    def __init__(self, dir, metrics=metrics.NULL):
         # 拡張子が`.jpg`の画像リストを作成
         self.image_list = []
         for dirname, _, filenames in os.walk(dir):
             self.image_list.extend([os.path.join(dirname, x) for x in filenames if x.lower().endswith(".jpg") or x.lower().endswith(".jpeg")])
             self.image_list.sort()
         self.start = 0
+        self.metrics = metrics
 
     def __iter__(self):
         return PhotoListIterator(self)
@@ -251,16 +265,23 @@ class PhotoList:
     def timedelta(self, i):
         return None
 
+    def frame_number(self, i):
+        return 0
+
     def filepath(self, i):
         return str(self.image_list[i])
     
     def length(self):
         return len(self.image_list)
 
+    def close(self):
+        pass
+
 class PhotoListIterator:
     def __init__(self, pl):
         self.image_list = pl.image_list
         self.index = pl.start
+        self.metrics = pl.metrics
 
     def __iter__(self):
         return self
@@ -269,98 +290,118 @@ class PhotoListIterator:
         image = None
         if self.index < len(self.image_list):
             filepath = str(self.image_list[self.index])
-            image = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+            with self.metrics.stage("decode"):
+                image = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
             self.index += 1
             return image
         else:
             raise StopIteration
 
-def detect_from_dir_or_video(dir_or_video):
+def detect_from_dir_or_video(dir_or_video, conf: config.Config,
+                             metrics=metrics.NULL):
     # 流星の写っていると思われる画像を抽出
     image_list = None
     
     if os.path.isdir(dir_or_video):
         print("directory: " + dir_or_video)
         dir = dir_or_video.rstrip("\\/")
-        image_list = PhotoList(dir)
+        image_list = PhotoList(dir, metrics)
     else:
         print("video: " + dir_or_video)
-        image_list = VideoFrames(dir_or_video, args.stack_frames)
+        image_list = VideoFrames(dir_or_video, conf.stack_frames, metrics,
+                                 conf.decoder, conf.decoder_threads,
+                                 conf.frame_step)
     
+    meteor_detector = detector.Detector(detector.DetectorParams.from_args(conf),
+                                        metrics=metrics)
+    budget_shape = None
+    profiler = None
+    if conf.memory_profile:
+        profiler = memprofile.MemoryProfiler()
+        profiler.start()
+        profiler.begin_frame()
     result = []
-    for i, image in enumerate(tqdm(image_list)):
-        lines, timg = detect_meteor(image, args.area_threshold,
-                                    args.area_value_threshold,
-                                    args.line_threshold)
+    frame_start = time.perf_counter()
+    for i, image in enumerate(tqdm.tqdm(image_list)):
+        if conf.memory_budget and image.shape != budget_shape:
+            budget_shape = image.shape
+            plan_memory_budget(meteor_detector, conf.memory_budget,
+                               image.shape)
+        lines, timg = meteor_detector.process(image)
+        metrics.count("frames")
         if lines is not None:
+            metrics.count("detections")
             entry = {}
             entry['file'] = path = image_list.filepath(i)
             timedelta = image_list.timedelta(i)
             entry['time'] = str(timedelta)
-            entry['frame'] = i if timedelta else 0
+            entry['frame'] = image_list.frame_number(i)
             entry['creation_time'] = creation_time = image_list.creation_time(i)
             entry['lines'] = lines.tolist()
             entry['snapshot'] = ss_file = "meteorsnap_" + os.path.basename(path) + (("_"+str(timedelta).replace(':', '_')) if timedelta else "") + ".png"
             result.append(entry)
             print("detected: {}{}".format(path, (": "+str(timedelta)) if timedelta else ""))
-            cimg = cv2.cvtColor(timg, cv2.COLOR_GRAY2RGB)
-            def draw_marker(img, color):
-                for line in lines:
-                    x1,y1,x2,y2 = line[0]
-                    cv2.rectangle(img, (x1,y1), (x2,y2),
-                                  color, args.marker_thickness)
-            cv2.imwrite(os.path.join(args.output_directory, ss_file),
-                        rgbadraw.draw(cimg, args.marker_color, draw_marker))
-
-    result_file = "result_" + os.path.basename(dir_or_video) + ".json"
-    with open(os.path.join(args.output_directory, result_file), mode='w') as f:
-        json.dump(result, f, indent=2)
+            with metrics.stage("snapshot"):
+                save_snapshot(os.path.join(conf.output_directory, ss_file),
+                              timg, lines, conf.marker_color,
+                              conf.marker_thickness, meteor_detector.strip_rows)
+        now = time.perf_counter()
+        metrics.observe("frame", now - frame_start)
+        frame_start = now
+        if profiler:
+            profiler.end_frame()
+            profiler.begin_frame()
+
+    image_list.close()
+
+    if profiler:
+        profiler.stop()
+        print(profiler.report())
+    if conf.memory_budget or conf.memory_profile:
+        print_peak_memory()
+
+    result_file = "result_" + os.path.basename(dir_or_video) + "." + conf.result_format
+    with metrics.stage("json"):
+        if conf.result_format == "npz":
+            store = resultstore.ResultStore.from_entries(result)
+            store.save(os.path.join(conf.output_directory, result_file))
+        else:
+            with open(os.path.join(conf.output_directory, result_file), mode='w') as f:
+                json.dump(result, f, indent=2)
         
     print("detected: {}/{}".format(len(result), image_list.length()))
         
 def main(argv: typing.List[str]) -> int:
     parser = argparse.ArgumentParser(description=version.version_string(__file__))
     parser.add_argument("directory_or_video", nargs='+')
-    parser.add_argument("--area-threshold", type=float, default=0.0)
-    parser.add_argument("--area-value-threshold", type=int, default=127)
-    parser.add_argument("--line-threshold", type=float, default=21)
-    parser.add_argument("--min-line-length", type=float, default=21)
-    parser.add_argument("--max-line-gap", type=float, default=5)
-    parser.add_argument("--hough-threshold", type=int, default=0)
-    parser.add_argument("--background-threshold", type=int, default=25)
-    parser.add_argument("--stack-frames", type=int, default=5)
-    parser.add_argument("--marker-color", default="(0,255,0)",
-                        help="'(B,G,R)' or '(B,G,R,A)' format.")
-    parser.add_argument("--marker-thickness", type=int, default=1)
+    SCHEMA.add_arguments(parser)
     parser.add_argument("--config-file", default=None)
-    parser.add_argument("--output-directory", default='.')
-    global args
-    args = parser.parse_args(argv[1:])
-
-    if args.version:
-        print_version()
-        exit
-
-    if args.config_file:
-        new_args = argutil.merge_config(parser, argv, args.config_file)
-        if new_args is not None:
-            args = new_args
-
+    parser.add_argument("--profile", default=None,
+                        help="profile name in the config file.")
     try:
-        args.marker_color = colorparse.parse(args.marker_color)
-    except (colorparse.ColorFormatError, colorparse.ColorValueError) as err:
+        args, conf = SCHEMA.parse_args(parser, argv[1:])
+    except config.ConfigError as err:
         print("ERROR: " + err.message, file=sys.stderr)
         return -1
 
-    if not os.path.exists(args.output_directory):
+    if not os.path.exists(conf.output_directory):
         try:
-            os.mkdir(args.output_directory)
+            os.mkdir(conf.output_directory)
         except Exception as err:
             print("ERROR: " + err.message, file=sys.stderr)
             return -1
     
+    stage_metrics = metrics.NULL
+    if conf.metrics_file:
+        stage_metrics = metrics.Metrics()
+
     for dir_or_video in args.directory_or_video:
-        detect_from_dir_or_video(dir_or_video)
+        detect_from_dir_or_video(dir_or_video, conf, stage_metrics)
+
+    if stage_metrics.enabled:
+        if conf.metrics_file != '-':
+            print(stage_metrics.summary())
+        stage_metrics.write(conf.metrics_file, conf.metrics_format)
         
     return 0
 
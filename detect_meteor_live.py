@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import os
+import sys
+import typing
+import datetime
+import json
+import time
+
+import config
+import detect_meteor
+import detector
+import livesource
+import metrics
+import version
+
+def parse_frame_size(size_str: str) -> typing.Tuple[int, int]:
+    w, h = size_str.lower().split("x")
+    return (int(w), int(h))
+
+SCHEMA = config.Schema(
+    config.DETECTION_OPTIONS,
+    config.MARKER_OPTIONS,
+    config.Option("queue-size", int, 8, minimum=1),
+    config.Option("overload", str, "drop", choices=livesource.OVERLOAD_POLICIES),
+    config.Option("pre-trigger", float, 2.0, minimum=0.0, help="seconds."),
+    config.Option("post-trigger", float, 2.0, minimum=0.0, help="seconds."),
+    config.Option("clip-fourcc", str, "mp4v"),
+    config.Option("disable-clip", bool, False),
+    config.Option("realtime", bool, False,
+                  help="read a video file at its frame rate."),
+    config.Option("frame-size", parse_frame_size, None,
+                  help="'WIDTHxHEIGHT' format (for '-')."),
+    config.Option("fps", float, 0.0, minimum=0.0),
+    config.Option("poll-interval", float, 1.0, minimum=0.0, help="seconds."),
+    config.Option("duration", float, 0.0, minimum=0.0,
+                  help="seconds. 0: until the source ends."),
+    config.Option("output-directory", str, '.'),
+    config.Option("memory-budget", int, 0, minimum=0,
+                  help="MiB. process frames in strips to fit. 0: unlimited."),
+    config.METRICS_OPTIONS,
+)
+
+def detect_live(source, conf: config.Config, stage_metrics=metrics.NULL):
+    start_time = datetime.datetime.now()
+    result_file = os.path.join(conf.output_directory,
+                               "result_live_{}.jsonl".format(
+                                   start_time.strftime("%Y%m%d_%H%M%S")))
+    print("source: " + source.name)
+    print("result: " + result_file)
+
+    queue = livesource.FrameQueue(conf.queue_size, conf.overload,
+                                  stage_metrics)
+    capture = livesource.CaptureThread(source, queue, stage_metrics)
+    fps = source.fps if source.fps and source.fps > 0 else 30.0
+    recorder = None
+    if not conf.disable_clip:
+        recorder = livesource.ClipRecorder(conf.output_directory, fps,
+                                           int(conf.pre_trigger * fps),
+                                           int(conf.post_trigger * fps),
+                                           conf.clip_fourcc)
+    meteor_detector = detector.Detector(detector.DetectorParams.from_args(conf),
+                                        metrics=stage_metrics)
+    stacker = detector.FrameStacker(conf.stack_frames)
+    # 比較明合成中の各フレームの (時刻, フレーム番号, ファイル名)
+    window = collections.deque(maxlen=conf.stack_frames)
+    budget_shape = None
+
+    capture.start()
+    deadline = None
+    if conf.duration > 0:
+        deadline = time.perf_counter() + conf.duration
+    first_time = None
+    count = 0
+    try:
+        with open(result_file, mode='w') as f:
+            while deadline is None or time.perf_counter() < deadline:
+                frame = queue.get(timeout=1.0)
+                if frame is None:
+                    if queue.finished():
+                        break
+                    continue
+                if first_time is None:
+                    first_time = frame.time
+                # 合成画像の作成(stack)とは別に計測する
+                with stage_metrics.stage("push"):
+                    stacker.push(frame.image)
+                if recorder:
+                    recorder.add(frame)
+                stage_metrics.count("frames")
+                window.append((frame.time, frame.number, frame.name))
+                if stacker.count < stacker.stack_size:
+                    continue
+                with stage_metrics.stage("stack"):
+                    image = stacker.stacked()
+                if conf.memory_budget and image.shape != budget_shape:
+                    budget_shape = image.shape
+                    # キューと録画用のリングバッファのカラーのフレームはまだ増える
+                    pre_frames = int(conf.pre_trigger * fps) \
+                        if recorder else 0
+                    detect_meteor.plan_memory_budget(
+                        meteor_detector, conf.memory_budget, image.shape,
+                        planes=3 * (conf.queue_size + pre_frames))
+                lines, timg = meteor_detector.process(image)
+                if lines is not None:
+                    stage_metrics.count("detections")
+                    count += 1
+                    # detect_meteor.py と同じく合成した最初のフレームの時刻とする
+                    frame_time, number, name = window[0]
+                    timedelta = frame_time - first_time
+                    entry = {}
+                    entry['file'] = name
+                    # detect_meteor.py の動画と同じく、撮影時刻(creation_time)は
+                    # 取り込みの開始時刻、time はそこからの経過時間とする
+                    entry['time'] = str(timedelta)
+                    entry['frame'] = number
+                    entry['creation_time'] = first_time.isoformat()
+                    entry['lines'] = lines.tolist()
+                    entry['snapshot'] = ss_file = "meteorsnap_live_{}.png".format(
+                        frame_time.strftime("%Y%m%d_%H%M%S_%f"))
+                    if recorder:
+                        entry['clip'] = recorder.trigger(frame)
+                    with stage_metrics.stage("snapshot"):
+                        detect_meteor.save_snapshot(
+                            os.path.join(conf.output_directory, ss_file),
+                            timg, lines, conf.marker_color,
+                            conf.marker_thickness,
+                            meteor_detector.strip_rows)
+                    # 検出したらすぐに1行ずつ書き出す(JSON Lines)
+                    with stage_metrics.stage("json"):
+                        f.write(json.dumps(entry) + "\n")
+                        f.flush()
+                    print("detected: {}".format(frame_time.isoformat()),
+                          flush=True)
+                # 取り込みから検出処理が終わるまでの遅延
+                stage_metrics.observe("latency",
+                                      time.perf_counter() - frame.captured)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.stop()
+        capture.join(timeout=5.0)
+        if recorder:
+            recorder.close()
+
+    print("detected: {}".format(count))
+    if conf.memory_budget:
+        detect_meteor.print_peak_memory()
+
+def main(argv: typing.List[str]) -> int:
+    parser = argparse.ArgumentParser(description=version.version_string(__file__))
+    parser.add_argument("source",
+                        help="camera number, stream URL, video file, "
+                        "directory to watch or '-' (raw bgr24 frames from stdin).")
+    SCHEMA.add_arguments(parser)
+    parser.add_argument("--config-file", default=None)
+    parser.add_argument("--profile", default=None,
+                        help="profile name in the config file.")
+    try:
+        args, conf = SCHEMA.parse_args(parser, argv[1:])
+    except config.ConfigError as err:
+        print("ERROR: " + err.message, file=sys.stderr)
+        return -1
+
+    if not os.path.exists(conf.output_directory):
+        try:
+            os.mkdir(conf.output_directory)
+        except Exception as err:
+            print("ERROR: " + str(err), file=sys.stderr)
+            return -1
+
+    try:
+        source = livesource.open_source(args.source, conf.realtime,
+                                        conf.frame_size, conf.fps,
+                                        conf.poll_interval)
+    except (IOError, ValueError) as err:
+        print("ERROR: " + str(err), file=sys.stderr)
+        return -1
+    if conf.fps > 0:
+        source.fps = conf.fps
+
+    stage_metrics = metrics.NULL
+    if conf.metrics_file:
+        stage_metrics = metrics.Metrics()
+
+    detect_live(source, conf, stage_metrics)
+
+    if stage_metrics.enabled:
+        if conf.metrics_file != '-':
+            print(stage_metrics.summary())
+        stage_metrics.write(conf.metrics_file, conf.metrics_format)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,783 @@
+from __future__ import annotations
+
+import math
+import typing
+
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+numpy = lazy_import('numpy')
+
+import metrics
+import rectutil
+
+# `area_reuse_frames` で検出結果を使い回す間に、シーンが変わったとみなす変化量
+# 画像の中央値（塗りつぶし色）の変化
+AREA_REUSE_MEDIAN_DELTA = 2.0
+# 明るいピクセル数の変化（面積の閾値に対する比率）
+AREA_REUSE_BRIGHT_RATIO = 0.5
+
+T = typing.TypeVar("T")
+def clamp(v: T, min_v: T, max_v: T) -> T:
+    """
+    clamp関数
+    入力値を`[min_v, max_v]`の範囲に収める
+    :param T v: 入力値
+    :param T min_v: 最小値
+    :param T max_v: 最大値
+    :return: `[min_v, max_v]`内に収めた値
+    """
+    return min(max_v, max(v, min_v))
+
+
+def histogram_median(img: numpy.array) -> float:
+    """
+    ヒストグラムを使った中央値の算出（8bit 画像用）
+    `numpy.median()` と同じ値を、画像全体のソートなしで求める
+    :param numpy.array img: 入力画像（グレイスケール、uint8）
+    :return: 中央値
+    """
+    hist = cv2.calcHist([img], [0], None, [256], [0, 256])
+    return histogram_median_of(hist)
+
+
+def histogram_median_of(hist: numpy.array) -> float:
+    """
+    ヒストグラムからの中央値の算出
+    :param numpy.array hist: 256 階調のヒストグラム（`cv2.calcHist()` の結果）
+    :return: 中央値
+    """
+    cum = numpy.cumsum(hist.ravel())
+    n = int(cum[-1])
+    lower = int(numpy.searchsorted(cum, (n - 1) // 2, side='right'))
+    upper = int(numpy.searchsorted(cum, n // 2, side='right'))
+    return (lower + upper) / 2
+
+
+def detect_area(img: numpy.array, threshold: float = 0.0001,
+                value_threshold: int = 127,
+                dst: typing.Optional[numpy.array] = None,
+                labels: typing.Optional[numpy.array] = None) -> typing.List[rectutil.Rect]:
+    """
+    閾値を超える面積を持つ領域の検出
+    :param numpy.array img: 入力画像
+    :param float threshold: 閾値（画像全体の何%を`(0, 1]`で指定）
+    :param int value_threshold: ピクセル値の閾値を `(0-255)`で指定）
+    :param numpy.array dst: 二値化に使う作業用バッファ（None の場合は確保する）
+    :param numpy.array labels: ラベリングに使う作業用バッファ（int32、None の場合は確保する）
+    :return: 閾値を超えた面積の領域の外接矩形 `(x, y, w, h)` のリスト
+    """
+    height, width = img.shape
+    img_area = width * height
+    ret, thr = cv2.threshold(img, value_threshold, 255,
+                             cv2.ADAPTIVE_THRESH_MEAN_C, dst=dst)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(
+        thr, labels=labels, connectivity=8, ltype=cv2.CV_32S)
+    # ラベル 0 は背景
+    stats = stats[1:]
+    stats = stats[stats[:, cv2.CC_STAT_AREA] > threshold * img_area]
+    return [tuple(int(v) for v in st[:4]) for st in stats]
+
+
+def detect_area_strips(img: numpy.array, strip_rows: int,
+                       threshold: float = 0.0001, value_threshold: int = 127,
+                       dst: typing.Optional[numpy.array] = None,
+                       labels: typing.Optional[numpy.array] = None) -> typing.List[rectutil.Rect]:
+    """
+    閾値を超える面積を持つ領域の検出（横長のストリップ毎の処理）
+    ストリップの境界をまたぐ領域は境界の上下の行の 8 近傍でつなぎ、
+    `detect_area()` と同じ領域を求める
+    :param numpy.array img: 入力画像
+    :param int strip_rows: ストリップの行数
+    :param float threshold: 閾値（画像全体の何%を`(0, 1]`で指定）
+    :param int value_threshold: ピクセル値の閾値を `(0-255)`で指定）
+    :param numpy.array dst: 二値化に使う作業用バッファ（`strip_rows` 行以上、None の場合は確保する）
+    :param numpy.array labels: ラベリングに使う作業用バッファ（int32、`strip_rows` 行以上、None の場合は確保する）
+    :return: 閾値を超えた面積の領域の外接矩形 `(x, y, w, h)` のリスト
+    """
+    height, width = img.shape
+    # 全ストリップの領域の [left, top, right, bottom, area] と Union-Find の親
+    regions = []
+    parent = []
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    prev_row = None
+    for y0 in range(0, height, strip_rows):
+        y1 = min(y0 + strip_rows, height)
+        rows = y1 - y0
+        _, thr = cv2.threshold(img[y0:y1], value_threshold, 255,
+                               cv2.ADAPTIVE_THRESH_MEAN_C,
+                               dst=None if dst is None else dst[:rows])
+        n, lab, stats, _ = cv2.connectedComponentsWithStats(
+            thr, labels=None if labels is None else labels[:rows],
+            connectivity=8, ltype=cv2.CV_32S)
+        # ラベル l (>= 1) の通し番号は offset + l
+        offset = len(regions) - 1
+        for x, y, w, h, area in stats[1:]:
+            regions.append([int(x), int(y) + y0, int(x + w), int(y + h) + y0,
+                            int(area)])
+            parent.append(len(parent))
+        first_row = lab[0]
+        if prev_row is not None:
+            # 前のストリップの最後の行と 8 近傍で接する領域をつなぐ
+            for dx in (-1, 0, 1):
+                upper = prev_row[max(0, -dx) : width - max(0, dx)]
+                lower = first_row[max(0, dx) : width - max(0, -dx)]
+                connected = (upper >= 0) & (lower > 0)
+                if not connected.any():
+                    continue
+                pairs = numpy.unique(numpy.stack(
+                    [upper[connected], lower[connected] + offset], axis=1),
+                    axis=0)
+                for a, b in pairs:
+                    ra, rb = find(int(a)), find(int(b))
+                    if ra != rb:
+                        parent[max(ra, rb)] = min(ra, rb)
+        last_row = lab[rows - 1]
+        prev_row = numpy.where(last_row > 0, last_row + offset, -1)
+
+    merged = {}
+    for i, (left, top, right, bottom, area) in enumerate(regions):
+        r = merged.setdefault(find(i), [left, top, right, bottom, 0])
+        r[0] = min(r[0], left)
+        r[1] = min(r[1], top)
+        r[2] = max(r[2], right)
+        r[3] = max(r[3], bottom)
+        r[4] += area
+    return [(left, top, right - left, bottom - top)
+            for left, top, right, bottom, area in merged.values()
+            if area > threshold * width * height]
+
+
+def fill_area(img: numpy.array, rects: typing.List[rectutil.Rect], buffer_ratio: float = 0.01, color: typing.Optional[float] = None) -> numpy.array:
+    """
+    領域の外接矩形で塗りつぶす
+    入力画像を直接書き換える
+    :param numpy.array img: 入力画像
+    :param rects: 領域の外接矩形リスト
+    :param float buffer_ratio: バッファ率 (e.g. 6000 * 0.01 => 60px)
+    :param float color: 塗りつぶしの色（未指定の場合は入力画像の中央値で塗りつぶす）
+    :return: 塗りつぶし後の画像
+    """
+    height, width = img.shape
+    # detect fill color
+    if color is None:
+        color = histogram_median(img)
+    color = int(round(color))
+    for x, y, w, h in fill_rects(rects, width, height, buffer_ratio):
+        img[y : y + h, x : x + w] = color
+    return img
+
+
+def fill_rects(rects: typing.List[rectutil.Rect], width: int, height: int,
+               buffer_ratio: float = 0.01) -> typing.List[rectutil.Rect]:
+    """
+    `fill_area()` で塗りつぶす矩形
+    領域の外接矩形をバッファ率だけ広げ、重なる矩形はまとめる
+    :param rects: 領域の外接矩形リスト
+    :param int width: 画像の幅
+    :param int height: 画像の高さ
+    :param float buffer_ratio: バッファ率
+    :return: 塗りつぶす矩形リスト
+    """
+    x_buffer = int(width * buffer_ratio)
+    y_buffer = int(height * buffer_ratio)
+    buffered = []
+    for x, y, w, h in rects:
+        left = clamp(x - x_buffer, 0, width)
+        top = clamp(y - y_buffer, 0, height)
+        right = clamp(x + w + x_buffer, 0, width)
+        bottom = clamp(y + h + y_buffer, 0, height)
+        buffered.append((left, top, right - left + 1, bottom - top + 1))
+    return rectutil.merge_rects(buffered)
+
+
+def get_background_level(img: numpy.array) -> typing.Tuple[float, float]:
+    """
+    背景レベルの算出
+    画像を 5x5 のタイルに分割し、タイル毎の中央値・平均値の最大値を求める
+    :param numpy.array img: 入力画像（グレイスケール）
+    :return: (中央値, 平均値)
+    """
+    height, width = img.shape[:2]
+    div = 5
+    tile_height = int(height / div)
+    tile_width = int(width / div)
+    means = []
+    medians = []
+    for ty in range(div):
+        y = int(tile_height * ty)
+        for tx in range(div):
+            x = int(tile_width * tx)
+            tile = img[y : y + tile_height, x : x + tile_height]
+            means.append(img.mean())
+            medians.append(numpy.median(numpy.array(tile).flatten()))
+
+    return max(medians), max(means)
+
+
+def auto_threshold(img: numpy.array) -> typing.Tuple[numpy.array, int]:
+    """
+    二値化の閾値の自動決定
+    背景レベルから閾値を上げていき、二値化後の背景がほぼ黒になる閾値を求める
+    :param numpy.array img: 入力画像（グレイスケール）
+    :return: (二値化画像, 閾値)
+    """
+    median, mean = get_background_level(img)
+    thr_median = 255
+    thr_mean = 255
+    while True:
+        m = int(median)
+        _, thr_img = cv2.threshold(img, m, 255, cv2.ADAPTIVE_THRESH_MEAN_C)
+        thr_median, thr_mean = get_background_level(thr_img)
+        if thr_mean <= 1.0:
+            break
+        median += 1
+    return thr_img, m
+
+
+def line_length(line: numpy.array) -> float:
+    """
+    直線の長さの算出
+    `cv2.HoughLinesP()`の返り値は`[ [ [start_x, start_y, end_x, end_y] ], ... ]`形式になっている
+    :param line: `[ [start_x, start_y, end_x, end_y] ]`であること
+    :return: 直線の長さ
+    """
+    assert len(line) == 1
+    sx, sy, ex, ey = line[0]
+    dx = ex - sx
+    dy = ey - sy
+    return math.sqrt(dx * dx + dy * dy)
+
+
+def merge_segments(a: typing.Sequence[int], b: typing.Sequence[int],
+                   max_gap: float,
+                   tolerance: float = 2.0) -> typing.Optional[typing.List[int]]:
+    """
+    同じ直線上にある二つの線分の結合
+    :param a: 線分 `[x1, y1, x2, y2]`
+    :param b: 線分 `[x1, y1, x2, y2]`
+    :param float max_gap: 結合する線分の間の隙間の最大値
+    :param float tolerance: 結合後の線分からの各端点の距離の許容値
+    :return: 結合した線分（同じ直線上にないか、離れている場合は None）
+    """
+    if line_length([a]) < line_length([b]):
+        a, b = b, a
+    ax1, ay1, ax2, ay2 = (float(v) for v in a)
+    length = math.hypot(ax2 - ax1, ay2 - ay1)
+    if length == 0:
+        return None
+    ux = (ax2 - ax1) / length
+    uy = (ay2 - ay1) / length
+    ends = [(a[0], a[1]), (a[2], a[3]), (b[0], b[1]), (b[2], b[3])]
+    # 長い方の線分の方向への射影で並べる（同じ直線上かどうかは結合後の線分で判定する）
+    points = [((x - ax1) * ux + (y - ay1) * uy, x, y) for x, y in ends]
+    if min(points[2][0], points[3][0]) > length + max_gap or \
+       max(points[2][0], points[3][0]) < -max_gap:
+        return None
+    _, x1, y1 = min(points)
+    _, x2, y2 = max(points)
+    # 四つの端点がすべて結合後の線分の近くにあること
+    merged_length = math.hypot(x2 - x1, y2 - y1)
+    if merged_length == 0:
+        return None
+    for x, y in ends:
+        if abs((x - x1) * (y2 - y1) - (y - y1) * (x2 - x1)) > \
+           tolerance * merged_length:
+            return None
+    return [int(x1), int(y1), int(x2), int(y2)]
+
+
+def merge_collinear(segments: typing.List[typing.List[int]], max_gap: float,
+                    tolerance: float = 2.0) -> typing.List[typing.List[int]]:
+    """
+    同じ直線上にある線分を結合できなくなるまで結合する
+    長い線分から順に、結合できる線分をすべて取り込む
+    :param segments: 線分 `[x1, y1, x2, y2]` のリスト
+    :param float max_gap: 結合する線分の間の隙間の最大値（0 の場合は重なっているものだけ）
+    :param float tolerance: 同じ直線上とみなす距離の許容値
+    :return: 結合後の線分のリスト
+    """
+    rest = sorted(segments, key=lambda s: -line_length([s]))
+    result = []
+    while rest:
+        current = rest.pop(0)
+        merged = True
+        while merged:
+            merged = False
+            top = min(current[1], current[3]) - max_gap
+            bottom = max(current[1], current[3]) + max_gap
+            for i, s in enumerate(rest):
+                # 縦方向に離れている線分は結合できない
+                if max(s[1], s[3]) < top or min(s[1], s[3]) > bottom:
+                    continue
+                m = merge_segments(current, s, max_gap, tolerance)
+                if m is not None:
+                    current = m
+                    del rest[i]
+                    merged = True
+                    break
+        result.append(current)
+    return result
+
+
+def merge_strip_lines(strips, max_gap: float,
+                      tolerance: float = 2.0) -> typing.Optional[numpy.array]:
+    """
+    ストリップ毎に検出した直線の統合
+    隣り合うストリップの境界毎に、重なりの行（と前後 `max_gap` 行）にかかる線分を
+    両方のストリップから集め、同じ直線上にあるものを結合できなくなるまで結合する。
+    境界をまたぐ直線は一本になり、重なりで両方のストリップから検出された線分は
+    重複がなくなる。結合した線分は次の境界でも結合の対象になる。最後に、結合で
+    延びた線分と重なるようになった同じ直線上の線分を取り込んで重複をなくす
+    :param strips: ストリップの `(開始行, 終了行, 直線リスト)` のリスト（上から順、直線は画像全体の座標）
+    :param float max_gap: 結合する線分の間の隙間の最大値
+    :param float tolerance: 同じ直線上とみなす距離の許容値
+    :return: `cv2.HoughLinesP()` 形式の直線リスト or None
+    """
+    segments = []
+    for _, _, lines in strips:
+        if lines is not None:
+            segments.extend(list(line[0]) for line in lines)
+    for (_, end, _), (start, _, _) in zip(strips, strips[1:]):
+        top = start - max_gap
+        bottom = end + max_gap
+        candidates = [s for s in segments
+                      if min(s[1], s[3]) <= bottom and max(s[1], s[3]) >= top]
+        if len(candidates) < 2:
+            continue
+        others = [s for s in segments
+                  if not (min(s[1], s[3]) <= bottom and max(s[1], s[3]) >= top)]
+        segments = others + merge_collinear(candidates, max_gap, tolerance)
+    segments = merge_collinear(segments, 0, tolerance)
+    if not segments:
+        return None
+    return numpy.array(segments, dtype=numpy.int32).reshape(-1, 1, 4)
+
+
+class DetectorParams:
+    """
+    流星検出パラメータ
+    :param background_threshold: 二値化の閾値 `(0-255)`（None の場合は自動決定）
+    :param float area_threshold: 面積のある領域検知用閾値（`detect_area()`関数`threshold`参照、0 で無効）
+    :param int area_value_threshold: 面積のある領域検知用のピクセル値の閾値 `(0-255)`
+    :param float line_threshold: 検出した直線を流星と判定する最小の長さ
+    :param float min_line_length: `cv2.HoughLinesP()` の `minLineLength`
+    :param float max_line_gap: `cv2.HoughLinesP()` の `maxLineGap`
+    :param int hough_threshold: `cv2.HoughLinesP()` の `threshold`
+    :param int area_reuse_frames: 面積のある領域の検出結果を何フレーム使い回すか（1 で毎フレーム検出、除外対象が動かないシーンが前提）
+    """
+    def __init__(self,
+                 background_threshold: typing.Optional[float] = 25,
+                 area_threshold: float = 0.0,
+                 area_value_threshold: int = 127,
+                 line_threshold: float = 21,
+                 min_line_length: float = 21,
+                 max_line_gap: float = 5,
+                 hough_threshold: int = 0,
+                 area_reuse_frames: int = 1):
+        self.background_threshold = background_threshold
+        self.area_threshold = area_threshold
+        self.area_value_threshold = area_value_threshold
+        self.line_threshold = line_threshold
+        self.min_line_length = min_line_length
+        self.max_line_gap = max_line_gap
+        self.hough_threshold = hough_threshold
+        self.area_reuse_frames = area_reuse_frames
+
+    @classmethod
+    def from_args(cls, args) -> "DetectorParams":
+        """
+        設定(`config.Config` または `argparse.Namespace`)からパラメータを作成
+        存在しない属性はデフォルト値を使用する
+        """
+        params = cls()
+        for name in vars(params):
+            if hasattr(args, name):
+                setattr(params, name, getattr(args, name))
+        return params
+
+
+# 作業用メモリの見積もり（入力画像の1画素あたりのバイト数）
+# 二値化 1 + `cv2.HoughLinesP()` 内部の複製 1 + 直線上の点 1（二値化画像の白の画素の割合による）
+BYTES_PER_PIXEL = 3
+# 面積のある領域の検出: 塗りつぶし用の複製 1 + 二値化 1 + ラベル 4
+AREA_BYTES_PER_PIXEL = 6
+# ストリップ毎に処理する場合のストリップの1画素あたり（二値化画像だけは画像全体の大きさで持つ）:
+# 面積のある領域の検出は二値化 1 + ラベル 4、
+# 直線検出もストリップ毎に行う場合は `cv2.HoughLinesP()` 内部の複製 1 + 直線上の点 1
+STRIP_AREA_BYTES_PER_PIXEL = 5
+STRIP_HOUGH_BYTES_PER_PIXEL = 2
+# ストリップの最小の行数
+MIN_STRIP_ROWS = 64
+
+def hough_accumulator_bytes(width: int, height: int) -> int:
+    """
+    `cv2.HoughLinesP()` の投票用配列の大きさ（1度刻み・1ピクセル刻みの場合）
+    """
+    return 4 * 180 * (2 * (width + height) + 1)
+
+def estimate_memory(shape: typing.Tuple[int, int], area: bool,
+                    strip_rows: int = 0, overlap: int = 0,
+                    hough_strips: bool = False) -> int:
+    """
+    `Detector` の作業用メモリの見積もり
+    :param shape: 入力画像のサイズ `(height, width)`
+    :param bool area: 面積のある領域の検出を行うか
+    :param int strip_rows: ストリップの行数（0 の場合は画像全体を一度に処理する）
+    :param int overlap: 隣り合うストリップの重なりの行数（直線検出をストリップ毎に行う場合）
+    :param bool hough_strips: 直線検出もストリップ毎に行うか
+    :return: バイト数
+    """
+    height, width = shape[:2]
+    if strip_rows <= 0:
+        return (BYTES_PER_PIXEL + (AREA_BYTES_PER_PIXEL if area else 0)) * \
+            width * height + hough_accumulator_bytes(width, height)
+    area_bytes = STRIP_AREA_BYTES_PER_PIXEL * width * \
+        min(strip_rows, height) if area else 0
+    if not hough_strips:
+        return BYTES_PER_PIXEL * width * height + area_bytes + \
+            hough_accumulator_bytes(width, height)
+    rows = min(strip_rows + overlap, height)
+    return width * height + area_bytes + \
+        STRIP_HOUGH_BYTES_PER_PIXEL * width * rows + \
+        hough_accumulator_bytes(width, rows)
+
+def plan_strip_rows(shape: typing.Tuple[int, int], budget: int, area: bool,
+                    overlap: int, extra_bytes_per_pixel: int = 0,
+                    hough_strips: bool = False) -> int:
+    """
+    作業用メモリが予算に収まるストリップの行数の決定
+    予算が小さすぎる場合も `MIN_STRIP_ROWS` 行と重なりの行数より小さくはしない
+    :param shape: 入力画像のサイズ `(height, width)`
+    :param int budget: 作業用メモリの予算（バイト）
+    :param bool area: 面積のある領域の検出を行うか
+    :param int overlap: 隣り合うストリップの重なりの行数（直線検出をストリップ毎に行う場合）
+    :param int extra_bytes_per_pixel: 呼び出し側がストリップ毎に使うメモリ（ストリップの1画素あたり）
+    :param bool hough_strips: 直線検出もストリップ毎に行うか
+    :return: ストリップの行数
+    """
+    height, width = shape[:2]
+    per_pixel = extra_bytes_per_pixel + \
+        (STRIP_AREA_BYTES_PER_PIXEL if area else 0)
+    if hough_strips:
+        per_pixel += STRIP_HOUGH_BYTES_PER_PIXEL
+        # 投票用配列はストリップの行数によらずほぼ画像の幅で決まる
+        budget -= width * height + hough_accumulator_bytes(width, 0)
+        rows = budget // (per_pixel * width + 4 * 180 * 2) - overlap
+        return int(max(rows, overlap, MIN_STRIP_ROWS))
+    budget -= BYTES_PER_PIXEL * width * height + \
+        hough_accumulator_bytes(width, height)
+    rows = budget // max(per_pixel * width, 1)
+    return int(max(rows, MIN_STRIP_ROWS))
+
+
+class Detector:
+    """
+    流星検出器
+    作業用バッファとパラメータを保持し、画像を一枚ずつ処理する
+
+        detector = Detector(DetectorParams(background_threshold=30))
+        lines, thr_img = detector.process(gray_img)
+
+    `strip_rows` を指定すると、面積のある領域の検出と二値化画像の塗りつぶしを
+    横長のストリップ毎に行い、作業用メモリを減らす（`plan_strip_rows()` 参照）。
+    直線検出は二値化画像全体に対して行うので、検出結果はストリップに分けない場合と同じになる。
+    `hough_strips` を指定すると直線検出も重なりのあるストリップ毎に行い、境界をまたぐ
+    線分を結合する（`cv2.HoughLinesP()` は点を無作為な順に処理するため、分けない場合と
+    検出結果が異なることがある）
+
+    :param DetectorParams params: 検出パラメータ
+    :param numpy.array mask: 検出対象領域のマスク（0 の画素は検出対象外、None の場合は全体）
+    :param metrics: 処理時間の計測先（`metrics.Metrics`、省略時は計測しない）
+    :param int strip_rows: ストリップの行数（0 の場合は画像全体を一度に処理する）
+    :param bool hough_strips: 直線検出もストリップ毎に行うか
+    """
+    def __init__(self, params: typing.Optional[DetectorParams] = None,
+                 mask: typing.Optional[numpy.array] = None,
+                 metrics=metrics.NULL, strip_rows: int = 0,
+                 hough_strips: bool = False):
+        self.params = params if params is not None else DetectorParams()
+        self.mask = mask
+        self.metrics = metrics
+        self.strip_rows = strip_rows
+        self.hough_strips = hough_strips
+        self.theta = math.pi / 180
+        # 作業用バッファ（入力画像と同じサイズで確保して使い回す）
+        self._work = None
+        self._area_thr = None
+        self._area_labels = None
+        self._thr = None
+        # 塗りつぶし領域と塗りつぶし色のキャッシュ（`area_reuse_frames` 参照）
+        self._area_rects = None
+        self._area_color = None
+        self._area_shape = None
+        self._area_age = 0
+        self._area_scene = None
+
+    def _buffer(self, buf: typing.Optional[numpy.array],
+                img: numpy.array, dtype=None,
+                shape: typing.Optional[typing.Tuple[int, int]] = None) -> numpy.array:
+        dtype = img.dtype if dtype is None else numpy.dtype(dtype)
+        shape = img.shape if shape is None else shape
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = numpy.empty(shape, dtype=dtype)
+        return buf
+
+    def overlap_rows(self) -> int:
+        """
+        隣り合うストリップの重なりの行数
+        流星と判定する長さの線分がどこかのストリップに収まるようにする
+        """
+        p = self.params
+        return int(math.ceil(max(p.min_line_length, p.line_threshold) +
+                             p.max_line_gap)) + 1
+
+    def _strips(self, img: numpy.array) -> int:
+        # 画像がストリップより小さい場合は画像全体を一度に処理する
+        rows = self.strip_rows
+        return rows if 0 < rows < img.shape[0] else 0
+
+    def detect_areas(self, img: numpy.array) -> typing.Tuple[typing.List[rectutil.Rect], typing.Optional[float]]:
+        """
+        月や街明かりなど面積のある明るい領域の検出
+        `area_reuse_frames` が 2 以上の場合、検出した領域と塗りつぶし色をそのフレーム数だけ使い回す
+        除外対象が動かないシーンを前提とするが、画像の中央値か閾値を超える明るいピクセル数が
+        検出時から大きく変わった場合（雲や薄明、月の出入りなど）はその時点で検出し直す
+        :param numpy.array img: 入力画像（グレイスケール）
+        :return: (領域の外接矩形リスト, 塗りつぶし色)
+        """
+        p = self.params
+        scene = self._scene(img) if p.area_reuse_frames > 1 else None
+        if (self._area_shape != img.shape or
+            self._area_age >= p.area_reuse_frames or
+            self._scene_changed(img, scene)):
+            rows = self._strips(img)
+            if rows:
+                shape = (rows, img.shape[1])
+                self._area_thr = self._buffer(self._area_thr, img, shape=shape)
+                self._area_labels = self._buffer(self._area_labels, img,
+                                                 numpy.int32, shape)
+                self._area_rects = detect_area_strips(img, rows,
+                                                      p.area_threshold,
+                                                      p.area_value_threshold,
+                                                      dst=self._area_thr,
+                                                      labels=self._area_labels)
+            else:
+                self._area_thr = self._buffer(self._area_thr, img)
+                self._area_labels = self._buffer(self._area_labels, img,
+                                                 numpy.int32)
+                self._area_rects = detect_area(img, p.area_threshold,
+                                               p.area_value_threshold,
+                                               dst=self._area_thr,
+                                               labels=self._area_labels)
+            if not self._area_rects:
+                self._area_color = None
+            elif scene is not None:
+                self._area_color = scene[0]
+            else:
+                self._area_color = histogram_median(img)
+            self._area_shape = img.shape
+            self._area_age = 0
+            self._area_scene = scene
+        self._area_age += 1
+        return self._area_rects, self._area_color
+
+    def _scene(self, img: numpy.array) -> typing.Tuple[float, int]:
+        # ヒストグラムから中央値と `detect_area()` で二値化されるピクセル数を求める
+        hist = cv2.calcHist([img], [0], None, [256], [0, 256]).ravel()
+        bright = int(hist[self.params.area_value_threshold + 1:].sum())
+        return histogram_median_of(hist), bright
+
+    def _scene_changed(self, img: numpy.array,
+                       scene: typing.Optional[typing.Tuple[float, int]]) -> bool:
+        if scene is None or self._area_scene is None:
+            return False
+        median, bright = scene
+        cached_median, cached_bright = self._area_scene
+        # 面積の閾値の半分以上の明るいピクセルが増減すると、領域が現れたり消えたりし得る
+        min_area = self.params.area_threshold * img.shape[0] * img.shape[1]
+        return (abs(median - cached_median) > AREA_REUSE_MEDIAN_DELTA or
+                abs(bright - cached_bright) > max(1.0, AREA_REUSE_BRIGHT_RATIO * min_area))
+
+    def fill_areas(self, img: numpy.array) -> numpy.array:
+        """
+        月や街明かりなど面積のある明るい領域の塗りつぶし
+        入力画像は書き換えず、塗りつぶしが必要な場合は作業用バッファに複製して塗りつぶす
+        :param numpy.array img: 入力画像（グレイスケール）
+        :return: 塗りつぶし後の画像
+        """
+        if self.params.area_threshold <= 0.0:
+            return img
+        rects, color = self.detect_areas(img)
+        if rects:
+            self._work = self._buffer(self._work, img)
+            numpy.copyto(self._work, img)
+            img = fill_area(self._work, rects, color=color)
+        return img
+
+    def threshold(self, img: numpy.array) -> typing.Tuple[numpy.array, int]:
+        """
+        二値化
+        :param numpy.array img: 入力画像（グレイスケール）
+        :return: (二値化画像, 適用した閾値)
+        """
+        background_threshold = self.params.background_threshold
+        if background_threshold is None:
+            thr, background_threshold = auto_threshold(img)
+        else:
+            self._thr = self._buffer(self._thr, img)
+            _, thr = cv2.threshold(img, background_threshold, 255,
+                                   cv2.ADAPTIVE_THRESH_MEAN_C, dst=self._thr)
+        if self.mask is not None:
+            thr = cv2.bitwise_and(thr, self.mask, dst=thr)
+        return thr, background_threshold
+
+    def hough_lines(self, thr: numpy.array) -> typing.Optional[numpy.array]:
+        """
+        二値化画像からの直線検出
+        :param numpy.array thr: 二値化画像
+        :return: `cv2.HoughLinesP()` 形式の直線リスト or None
+        """
+        p = self.params
+        return cv2.HoughLinesP(thr, rho=1, theta=self.theta,
+                               threshold=p.hough_threshold,
+                               minLineLength=p.min_line_length,
+                               maxLineGap=p.max_line_gap)
+
+    def find_lines(self, img: numpy.array) -> typing.Tuple[typing.Optional[numpy.array], numpy.array, int]:
+        """
+        直線検出（流星判定なし）
+        :param numpy.array img: 入力画像（グレイスケール）
+        :return: (検出直線リスト or None, 二値化画像, 適用した閾値)
+        """
+        rows = self._strips(img)
+        if rows and self.params.background_threshold is not None:
+            return self.find_lines_strips(img, rows)
+        m = self.metrics
+        with m.stage("area"):
+            img = self.fill_areas(img)
+        with m.stage("threshold"):
+            thr, background_threshold = self.threshold(img)
+        with m.stage("hough"):
+            lines = self.hough_lines(thr)
+        return lines, thr, background_threshold
+
+    def find_lines_strips(self, img: numpy.array, rows: int) -> typing.Tuple[typing.Optional[numpy.array], numpy.array, int]:
+        """
+        直線検出（ストリップ毎の処理、流星判定なし）
+        二値化画像だけを画像全体の大きさで持ち、面積のある領域の検出はストリップ毎に行う。
+        塗りつぶしは二値化後の画像に塗りつぶし色を二値化した値で行うので、入力画像の
+        複製が不要になる。直線検出は `hough_strips` の場合だけストリップ毎に行う
+        :param numpy.array img: 入力画像（グレイスケール）
+        :param int rows: ストリップの行数
+        :return: (検出直線リスト or None, 二値化画像, 適用した閾値)
+        """
+        p = self.params
+        m = self.metrics
+        height, width = img.shape
+        rects = None
+        with m.stage("area"):
+            if p.area_threshold > 0.0:
+                rects, color = self.detect_areas(img)
+        with m.stage("threshold"):
+            self._thr = self._buffer(self._thr, img)
+            _, thr = cv2.threshold(img, p.background_threshold, 255,
+                                   cv2.ADAPTIVE_THRESH_MEAN_C, dst=self._thr)
+            if rects:
+                value = 255 if int(round(color)) > p.background_threshold else 0
+                for x, y, w, h in fill_rects(rects, width, height):
+                    thr[y : y + h, x : x + w] = value
+            if self.mask is not None:
+                thr = cv2.bitwise_and(thr, self.mask, dst=thr)
+        with m.stage("hough"):
+            if not self.hough_strips:
+                return self.hough_lines(thr), thr, p.background_threshold
+            overlap = self.overlap_rows()
+            strips = []
+            for start in range(0, height, rows):
+                end = min(start + rows + overlap, height)
+                lines = self.hough_lines(thr[start:end])
+                if lines is not None:
+                    lines[:, :, 1::2] += start
+                strips.append((start, end, lines))
+                if end == height:
+                    break
+            lines = merge_strip_lines(strips, p.max_line_gap)
+        return lines, thr, p.background_threshold
+
+    def process(self, img: numpy.array) -> typing.Tuple[typing.Optional[numpy.array], typing.Optional[numpy.array]]:
+        """
+        流星の検出
+        返される二値化画像は作業用バッファなので、次の呼び出しで上書きされる
+        :param numpy.array img: 入力画像（グレイスケール）
+        :return: (検出した直線, 二値化画像) or (None, None)
+        """
+        lines, thr, _ = self.find_lines(img)
+        if lines is not None:
+            length = max([line_length(x) for x in lines])
+            if length > self.params.line_threshold:
+                return lines, thr
+        return None, None
+
+
+class FrameStacker:
+    """
+    連続フレームの比較明合成
+    直近 `stack_size` フレームをグレイスケールでリングバッファに保持する
+
+    :param int stack_size: 合成するフレーム数
+    """
+    def __init__(self, stack_size: int):
+        self.stack_size = stack_size
+        self._ring = None
+        self._result = None
+        self.count = 0
+        self.pos = 0
+
+    def _allocate(self, shape: typing.Tuple[int, int]):
+        self._ring = numpy.empty((self.stack_size,) + shape, dtype=numpy.uint8)
+        self._result = numpy.empty(shape, dtype=numpy.uint8)
+        self.count = 0
+        self.pos = 0
+
+    def slot(self, shape: typing.Tuple[int, int]) -> numpy.array:
+        """
+        次に追加するフレームの書き込み先（最も古いフレームの領域）
+        デコーダが直接書き込んだ後に `advance()` を呼ぶ
+        :param shape: フレームのサイズ `(height, width)`
+        :return: 書き込み先のバッファ
+        """
+        if self._ring is None or self._ring.shape[1:] != shape:
+            self._allocate(shape)
+        return self._ring[self.pos]
+
+    def advance(self):
+        """
+        `slot()` に書き込んだフレームを追加済みにする
+        """
+        self.pos = (self.pos + 1) % self.stack_size
+        self.count = min(self.count + 1, self.stack_size)
+
+    def push(self, frame: numpy.array):
+        """
+        フレームの追加（最も古いフレームを置き換える）
+        :param numpy.array frame: 入力フレーム（BGR またはグレイスケール）
+        """
+        slot = self.slot(frame.shape[:2])
+        if frame.ndim == 3:
+            # グレースケール画像に変換
+            cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=slot)
+        else:
+            numpy.copyto(slot, frame)
+        self.advance()
+
+    def stacked(self) -> numpy.array:
+        """
+        比較明合成
+        返される画像は作業用バッファなので、次の呼び出しで上書きされる
+        :return: 合成画像（グレイスケール）
+        """
+        return numpy.max(self._ring[:self.count], axis=0, out=self._result)
@@ -0,0 +1,27 @@
+import importlib
+import importlib.util
+import sys
+
+def lazy_import(name: str):
+    """
+    モジュールの遅延読み込み
+    属性を最初に参照した時にモジュールを読み込むので、`--help` だけの場合などに
+    cv2・numpy などの重いモジュールの読み込み時間がかからない
+    :param str name: モジュール名（`PIL.Image` などのサブモジュールも可）
+    :return: モジュール
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        # 見つからない場合は通常の import で ImportError にする
+        return importlib.import_module(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    if '.' in name:
+        parent, child = name.rsplit('.', 1)
+        setattr(sys.modules[parent], child, module)
+    return module
@@ -3,29 +3,37 @@
 import argparse
 import os
 import sys
-import cv2
-import numpy
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+numpy = lazy_import('numpy')
 
+import videosource
 import version
 
 def main(argv):
     parser = argparse.ArgumentParser(description=version.version_string(__file__))
     parser.add_argument("video_file")
     parser.add_argument("output_file")
+    parser.add_argument("--decoder", default="opencv",
+                        choices=videosource.DECODERS)
+    parser.add_argument("--decoder-threads", type=int, default=0,
+                        help="0: auto.")
     args = parser.parse_args(argv[1:])
     
-    cap = cv2.VideoCapture(args.video_file)
+    decoder = videosource.open_decoder(args.video_file, args.decoder,
+                                       threads=args.decoder_threads)
     result = None
+    frame = None
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        frame = decoder.read(frame)
+        if frame is None:
             break
         else:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
             if result is None:
-                result = frame
+                result = frame.copy()
             else:
-                result = numpy.maximum(frame, result)
+                numpy.maximum(frame, result, out=result)
+    decoder.release()
     cv2.imwrite(args.output_file, result)
 
 if __name__ == "__main__":
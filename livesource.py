@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+import typing
+
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+numpy = lazy_import('numpy')
+
+import metrics
+
+# 監視ディレクトリで読み込む画像ファイルの拡張子
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+OVERLOAD_POLICIES = ("drop", "stack")
+
+class Frame:
+    """
+    取り込んだフレーム
+    :param numpy.array image: フレーム画像（BGR）
+    :param datetime.datetime time: 撮影時刻
+    :param str name: 取り込み元の名前（ファイル名など）
+    """
+    def __init__(self, image: numpy.array, time: datetime.datetime, name: str):
+        self.image = image
+        self.time = time
+        self.name = name
+        # キューに入れた時刻（遅延の計測用）
+        self.captured = 0.0
+        # 過負荷時に比較明合成でまとめたフレーム数
+        self.stacked = 1
+        # 取り込んだ順の番号（キューで捨てたフレームも数える）
+        self.number = 0
+
+
+class CaptureSource:
+    """
+    `cv2.VideoCapture` で開けるもの（カメラ番号、ストリームの URL、動画ファイル）からの取り込み
+    :param source: カメラ番号または URL・ファイルパス
+    :param bool realtime: 動画ファイルをフレームレートに合わせて読み込むか（ライブ配信の代わりに試す場合）
+    """
+    def __init__(self, source: typing.Union[int, str], realtime: bool = False):
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise IOError("cannot open: " + str(source))
+        self.name = str(source)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        # カメラとストリームは取り込んだ時刻、ファイルは先頭からの再生時間で時刻を決める
+        self.is_file = isinstance(source, str) and os.path.isfile(source)
+        self.realtime = realtime
+        # フレームレートに合わせずに読み込むファイルは、フレームを捨てずに検出処理を待つ
+        self.live = not self.is_file or realtime
+        self.start_time = None
+        self.start_clock = None
+
+    def read(self) -> typing.Optional[Frame]:
+        """
+        次のフレームの取り込み
+        :return: フレーム（終端の場合は None）
+        """
+        ret, img = self.cap.read()
+        if not ret:
+            return None
+        now = datetime.datetime.now()
+        if self.start_time is None:
+            self.start_time = now
+            self.start_clock = time.perf_counter()
+        if not self.is_file:
+            return Frame(img, now, self.name)
+        elapsed = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if self.realtime:
+            wait = self.start_clock + elapsed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        return Frame(img, self.start_time + datetime.timedelta(seconds=elapsed),
+                     self.name)
+
+    def release(self):
+        self.cap.release()
+
+
+class PipeSource:
+    """
+    パイプからの無圧縮フレーム(bgr24)の取り込み
+    ffmpeg などでストリームを受信・デコードしてパイプで渡す場合に使う
+    :param stream: 入力ストリーム（バイナリ）
+    :param int width: フレームの幅
+    :param int height: フレームの高さ
+    :param float fps: フレームレート
+    """
+    def __init__(self, stream, width: int, height: int, fps: float):
+        self.stream = stream
+        self.shape = (height, width, 3)
+        self.frame_bytes = width * height * 3
+        self.fps = fps
+        self.name = "pipe"
+        self.live = True
+
+    def read(self) -> typing.Optional[Frame]:
+        img = numpy.empty(self.shape, dtype=numpy.uint8)
+        view = memoryview(img.reshape(-1))
+        n = 0
+        while n < self.frame_bytes:
+            r = self.stream.readinto(view[n:])
+            if not r:
+                return None
+            n += r
+        return Frame(img, datetime.datetime.now(), self.name)
+
+    def release(self):
+        pass
+
+
+class DirectorySource:
+    """
+    ディレクトリに追加される画像ファイルの取り込み
+    ファイル名順に読み込み、書き込み中のファイルはサイズが変わらなくなるまで待つ
+    :param str directory: 監視するディレクトリ
+    :param float poll_interval: ディレクトリを調べる間隔（秒）
+    :param float fps: クリップ動画のフレームレート
+    """
+    def __init__(self, directory: str, poll_interval: float = 1.0,
+                 fps: float = 1.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.fps = fps
+        self.name = directory
+        self.live = True
+        self.seen = set()
+        self.sizes = {}
+        self.ready = collections.deque()
+        self.closed = False
+
+    def _poll(self):
+        for filename in sorted(os.listdir(self.directory)):
+            if filename in self.seen or \
+               not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if size > 0 and self.sizes.get(filename) == size:
+                self.seen.add(filename)
+                del self.sizes[filename]
+                self.ready.append(path)
+            else:
+                self.sizes[filename] = size
+
+    def read(self) -> typing.Optional[Frame]:
+        while not self.ready:
+            if self.closed:
+                return None
+            self._poll()
+            if not self.ready:
+                time.sleep(self.poll_interval)
+        path = self.ready.popleft()
+        img = cv2.imread(path)
+        if img is None:
+            return self.read()
+        t = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        return Frame(img, t, path)
+
+    def release(self):
+        self.closed = True
+
+
+def open_source(source: str, realtime: bool = False,
+                frame_size: typing.Optional[typing.Tuple[int, int]] = None,
+                fps: float = 0.0, poll_interval: float = 1.0):
+    """
+    取り込み元の作成
+    :param str source: カメラ番号、URL、動画ファイル、ディレクトリ、または `-`（標準入力）
+    :param bool realtime: 動画ファイルをフレームレートに合わせて読み込むか
+    :param frame_size: パイプ入力のフレームサイズ `(width, height)`
+    :param float fps: フレームレート（パイプ入力とディレクトリの場合）
+    :param float poll_interval: ディレクトリを調べる間隔（秒）
+    :return: 取り込み元
+    """
+    if source == "-":
+        if frame_size is None:
+            raise ValueError("frame size is required for pipe input.")
+        return PipeSource(sys.stdin.buffer, frame_size[0], frame_size[1],
+                          fps or 30.0)
+    if os.path.isdir(source):
+        return DirectorySource(source, poll_interval, fps or 1.0)
+    if source.isdigit():
+        return CaptureSource(int(source))
+    return CaptureSource(source, realtime)
+
+
+class FrameQueue:
+    """
+    取り込みスレッドから検出処理に渡すフレームのキュー
+    容量を越えた場合は、`drop` では最も古いフレームを捨て、
+    `stack` では最後のフレームに比較明合成して、遅延が一定以上にならないようにする
+    :param int size: キューの容量
+    :param str policy: `drop` または `stack`
+    :param metrics: 計測用の `metrics.Metrics`
+    """
+    def __init__(self, size: int, policy: str = "drop", metrics=metrics.NULL):
+        self.size = max(size, 1)
+        self.policy = policy
+        self.metrics = metrics
+        self.frames = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def put(self, frame: Frame, block: bool = False):
+        """
+        フレームの追加
+        :param Frame frame: フレーム
+        :param bool block: 容量を越える場合に空きができるまで待つか
+        """
+        with self.cond:
+            while block and len(self.frames) >= self.size and not self.closed:
+                self.cond.wait()
+            frame.captured = time.perf_counter()
+            if len(self.frames) >= self.size:
+                if self.policy == "stack":
+                    last = self.frames[-1]
+                    numpy.maximum(last.image, frame.image, out=last.image)
+                    last.stacked += frame.stacked
+                    self.metrics.count("stacked")
+                    return
+                self.frames.popleft()
+                self.metrics.count("dropped")
+            self.frames.append(frame)
+            self.cond.notify()
+
+    def get(self, timeout: typing.Optional[float] = None) -> typing.Optional[Frame]:
+        """
+        フレームの取り出し（フレームが来るまで待つ）
+        :param float timeout: 待つ時間の上限（秒）
+        :return: フレーム（終了した場合とタイムアウトの場合は None）
+        """
+        with self.cond:
+            if not self.frames and not self.closed:
+                self.cond.wait(timeout)
+            if self.frames:
+                frame = self.frames.popleft()
+                self.cond.notify_all()
+                return frame
+            return None
+
+    def finished(self) -> bool:
+        """
+        取り込みが終了し、キューが空になったかどうか
+        """
+        with self.cond:
+            return self.closed and not self.frames
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class CaptureThread(threading.Thread):
+    """
+    取り込み元からフレームを読み込んでキューに入れるスレッド
+    :param source: 取り込み元
+    :param FrameQueue queue: 出力先のキュー
+    :param metrics: 計測用の `metrics.Metrics`
+    """
+    def __init__(self, source, queue: FrameQueue, metrics=metrics.NULL):
+        super().__init__(daemon=True)
+        self.source = source
+        self.queue = queue
+        self.metrics = metrics
+        self.running = True
+        self.count = 0
+
+    def run(self):
+        try:
+            while self.running:
+                with self.metrics.stage("decode"):
+                    frame = self.source.read()
+                if frame is None:
+                    break
+                # 番号は取り込み時に付けて、捨てたフレームの分も進める
+                frame.number = self.count
+                self.count += 1
+                self.queue.put(frame, block=not self.source.live)
+        finally:
+            self.queue.close()
+            # read() 中に他のスレッドから解放しないように、取り込み元はこのスレッドで解放する
+            self.source.release()
+
+    def stop(self):
+        """
+        取り込みの停止の要求（読み込み中のフレームの後で停止する）
+        """
+        self.running = False
+        # キューの空きを待っている場合に待機を解除する
+        self.queue.close()
+
+
+class ClipRecorder:
+    """
+    検出の前後のフレームを動画クリップとして保存する
+    直近のフレームを常に `pre_frames` だけ保持し、検出時にそこから書き出すので、
+    取り込み元を読み直したり、全フレームを保存しておく必要がない
+    :param str output_directory: 出力先ディレクトリ
+    :param float fps: クリップのフレームレート
+    :param int pre_frames: 検出前に保持するフレーム数
+    :param int post_frames: 検出後に書き出すフレーム数
+    :param str fourcc: 動画のコーデック
+    """
+    def __init__(self, output_directory: str, fps: float, pre_frames: int,
+                 post_frames: int, fourcc: str = "mp4v"):
+        self.output_directory = output_directory
+        self.fps = fps
+        self.post_frames = post_frames
+        self.fourcc = fourcc
+        self.buffer = collections.deque(maxlen=max(pre_frames, 1))
+        self.writer = None
+        self.filename = None
+        self.remaining = 0
+
+    def add(self, frame: Frame):
+        """
+        フレームの追加（記録中ならクリップに書き出す）
+        """
+        if self.writer is not None:
+            self.writer.write(frame.image)
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.close()
+        else:
+            self.buffer.append(frame)
+
+    def trigger(self, frame: Frame) -> str:
+        """
+        検出時の記録開始（記録中の場合は記録を延長する）
+        :param Frame frame: 検出したフレーム
+        :return: クリップのファイル名
+        """
+        if self.writer is None:
+            self.filename = "meteorclip_{}.mp4".format(
+                frame.time.strftime("%Y%m%d_%H%M%S_%f"))
+            h, w = frame.image.shape[:2]
+            self.writer = cv2.VideoWriter(
+                os.path.join(self.output_directory, self.filename),
+                cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (w, h))
+            while self.buffer:
+                self.writer.write(self.buffer.popleft().image)
+        self.remaining = self.post_frames
+        return self.filename
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
@@ -4,27 +4,46 @@ import argparse
 import os
 import sys
 import datetime
-import dateutil
-import dateutil.parser
-import json
-import ffmpeg
-import cv2
-import numpy as np
 
-import colorparse
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+dateutil_parser = lazy_import('dateutil.parser')
+
 import rgbadraw
-import argutil
+import rectutil
+import config
+import resultstore
+import videosource
 import version
 
-args = None
-
+# cv2 を読み込まずに済むように定数名で持つ
 ROT_TABLE = {
-    90: cv2.ROTATE_90_CLOCKWISE,
-    180: cv2.ROTATE_180,
-    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
-    -90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    90: "ROTATE_90_CLOCKWISE",
+    180: "ROTATE_180",
+    270: "ROTATE_90_COUNTERCLOCKWISE",
+    -90: "ROTATE_90_COUNTERCLOCKWISE",
 }
 
+SCHEMA = config.Schema(
+    config.Option("margin-before", float, 2.0),
+    config.Option("margin-after", float, 2.0),
+    # 無効にした場合の色は検証しない
+    [config.unless("disable-marker", o) if o.type is config.color else o
+     for o in config.MARKER_OPTIONS],
+    config.Option("timestamp-color", config.color, "(160,160,160)",
+                  help="'(B,G,R)' or '(B,G,R,A)' format.",
+                  unless="disable-timestamp"),
+    config.Option("timestamp-font-scale", float, 1.0),
+    config.Option("disable-marker", bool, False),
+    config.Option("disable-timestamp", bool, False),
+    config.Option("output-directory", str, '.'),
+    config.Option("pipe", bool, False),
+    config.Option("gamma", float, 1.0),
+    config.Option("cue", float, 0.0),
+    config.Option("rotation", int, 0, choices=(0, 90, 180, 270, -90)),
+)
+
 def make_lut(gamma):
     lut = np.zeros((256, 1), dtype=np.uint8)
     for i in range(256):
@@ -32,27 +51,30 @@ def make_lut(gamma):
     return lut
 
 def parse_timedelta(time_str):
-    h, m, s = map(float, time_str.split(":"))
-    return datetime.timedelta(hours=h, minutes=m, seconds=s)
-
-def make_digest_movie(detection_result_file,
-                      marker_color, marker_thickness,
-                      timestamp_color, timestamp_font_scale, gamma, cue):
+    # 24時間以上の `1 day, 0:00:01` 形式も resultstore と同じく解析する
+    return datetime.timedelta(microseconds=resultstore.parse_time(time_str))
+
+def make_digest_movie(detection_result_file, conf: config.Config):
+    marker_color = None if conf.disable_marker else conf.marker_color
+    marker_thickness = conf.marker_thickness
+    timestamp_color = None if conf.disable_timestamp else conf.timestamp_color
+    timestamp_font_scale = conf.timestamp_font_scale
+    gamma = conf.gamma
+    cue = conf.cue
     lut = make_lut(gamma)
     cue_ms = int(cue * 1000)
     basename = os.path.basename(detection_result_file)
-    output_filename = os.path.join(args.output_directory,
+    output_filename = os.path.join(conf.output_directory,
                                    os.path.splitext(basename)[0] + '.mp4')
-    if not args.pipe:
+    if not conf.pipe:
         print("detection result: " + detection_result_file)
         print("output: " + output_filename)
     
-    detections = []
-    with open(detection_result_file) as f:
-        detections = json.load(f)
+    # detect_meteor.py の JSON・npz 形式と detect_meteor_live.py の JSON Lines 形式に対応する
+    detections = resultstore.load(detection_result_file).entries()
 
     if len(detections) == 0:
-        if not args.pipe:
+        if not conf.pipe:
             print("no meteor detected. skip.")
         return
     
@@ -60,15 +82,16 @@ def make_digest_movie(detection_result_file,
     
     # result と動画が1対1対応すると仮定
     video_file = detections[0]['file']
-    if not args.pipe:
+    if not conf.pipe:
         print("video:" + video_file)
-    video_info = ffmpeg.probe(video_file)
-    creation_time = video_info['streams'][0]['tags']['creation_time']
+    creation_time = videosource.probe(video_file).creation_time
     cap = cv2.VideoCapture(video_file)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    # 検出時刻の照合の許容誤差（デコーダによるタイムスタンプの差を吸収する）
+    tolerance = datetime.timedelta(seconds=0.5 / fps if fps > 0 else 0.001)
     writer = None
-    if not args.pipe:
+    if not conf.pipe:
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        fps = cap.get(cv2.CAP_PROP_FPS)
         size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
                 int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
         writer = cv2.VideoWriter(output_filename, fourcc, fps, size)
@@ -79,8 +102,8 @@ def make_digest_movie(detection_result_file,
     detects = []
     for detect in detections:
         delta = parse_timedelta(detect['time'])
-        start = delta - datetime.timedelta(seconds=args.margin_before)
-        end = delta + datetime.timedelta(seconds=args.margin_after)
+        start = delta - datetime.timedelta(seconds=conf.margin_before)
+        end = delta + datetime.timedelta(seconds=conf.margin_after)
         # print("[" + str(start) + " - " + str(end) + "] : " + str(delta))
         if prev_start is None:
             prev_start = start
@@ -110,7 +133,7 @@ def make_digest_movie(detection_result_file,
     rec = False
     for tl in timelines:
         detects = tl['detects']
-        if not args.pipe:
+        if not conf.pipe:
             print(str(tl['start']) + " - " +
                   str(tl['end']) + " : detects=" + str(len(detects)))
         while True:
@@ -127,25 +150,28 @@ def make_digest_movie(detection_result_file,
                 if gamma is not 0:
                     img = cv2.LUT(img, lut)
                 for d in detects:
-                    if str(time) == d['time']:
+                    if abs(time - parse_timedelta(d['time'])) < tolerance:
                         def draw_marker(img, color):
                             for line in d['lines']:
                                 x1, y1, x2, y2 = line[0]
                                 cv2.rectangle(img, (x1, y1), (x2, y2),
                                               color, marker_thickness)
                         if (marker_color):
-                            img = rgbadraw.draw(img, marker_color, draw_marker)
-                if args.rotation != 0:
-                    img = cv2.rotate(img, ROT_TABLE[args.rotation])
+                            rects = rectutil.marker_rects(d['lines'],
+                                                          marker_thickness)
+                            img = rgbadraw.draw(img, marker_color, draw_marker,
+                                                rects)
+                if conf.rotation != 0:
+                    img = cv2.rotate(img, getattr(cv2, ROT_TABLE[conf.rotation]))
                 # タイムゾーンを考慮しないカメラ用の補正(JST固定)
                 ct_str = creation_time.replace('Z', '+09:00')
-                t = dateutil.parser.parse(ct_str) + time
+                t = dateutil_parser.parse(ct_str) + time
+                text = str(t)
+                (w, h), b = cv2.getTextSize(text,
+                                            cv2.FONT_HERSHEY_COMPLEX,
+                                            timestamp_font_scale, 1)
                 def draw_timestamp(img, color):
-                    text = str(t)
-                    (w, h), b = cv2.getTextSize(text,
-                                                cv2.FONT_HERSHEY_COMPLEX,
-                                                timestamp_font_scale, 1)
-                    cv2.putText(img, text=str(t), org=(2,2+h),
+                    cv2.putText(img, text=text, org=(2,2+h),
                                 fontFace=cv2.FONT_HERSHEY_COMPLEX,
                                 fontScale=timestamp_font_scale,
                                 color=color, lineType=cv2.LINE_AA)
@@ -154,8 +180,11 @@ def make_digest_movie(detection_result_file,
                                  thickness=2, lineType=cv2.LINE_4)
                         
                 if (timestamp_color):
-                    img = rgbadraw.draw(img, timestamp_color, draw_timestamp)
-                if args.pipe:
+                    # タイムスタンプと下線の描画範囲
+                    rects = [(0, 0, w + 6, h + b + 10)]
+                    img = rgbadraw.draw(img, timestamp_color, draw_timestamp,
+                                        rects)
+                if conf.pipe:
                     sys.stdout.buffer.write(img.tobytes())
                 else:
                     writer.write(img)
@@ -163,73 +192,37 @@ def make_digest_movie(detection_result_file,
             if tl['end'] < time:
                 rec = False
                 break
-    if not args.pipe:
+    if not conf.pipe:
         writer.release()
     cap.release()
 
 def main(argv):
     parser = argparse.ArgumentParser(description=version.version_string(__file__))
     parser.add_argument("detection_result_file", nargs='+')
-    parser.add_argument("--margin-before", type=float, default=2.0)
-    parser.add_argument("--margin-after", type=float, default=2.0)
-    parser.add_argument("--marker-color", default="(0,255,0)",
-                        help="'(B,G,R)' or '(B,G,R,A)' format.")
-    parser.add_argument("--marker-thickness", type=int, default=1)
-    parser.add_argument("--timestamp-color", default="(160,160,160)",
-                        help="'(B,G,R)' or '(B,G,R,A)' format.")
-    parser.add_argument("--timestamp-font-scale", type=float, default=1.0)
-    parser.add_argument("--disable-marker", action="store_true")
-    parser.add_argument("--disable-timestamp", action="store_true")
+    SCHEMA.add_arguments(parser)
     parser.add_argument("--config-file", default=None)
-    parser.add_argument("--output-directory", default='.')
-    parser.add_argument("--pipe", action="store_true")
-    parser.add_argument("--gamma", type=float, default='1')
-    parser.add_argument("--cue", type=float, default=0)
-    parser.add_argument("--rotation", type=int, default=0)
-    global args
-    args = parser.parse_args(argv[1:])
-
-    if args.config_file:
-        new_args = argutil.merge_config(parser, argv, args.config_file,
-                                        ('--disable-marker',
-                                         '--disable-timestamp',
-                                         '--pipe'))
-        if new_args is not None:
-            args = new_args
+    parser.add_argument("--profile", default=None,
+                        help="profile name in the config file.")
+    try:
+        args, conf = SCHEMA.parse_args(parser, argv[1:])
+    except config.ConfigError as err:
+        print("ERROR: " + err.message, file=sys.stderr)
+        return -1
+    if conf.pipe and not hasattr(sys.stdout, "buffer"):
+        # smd.py のサーバーで実行した場合など（設定ファイルで指定した場合を含む）
+        print("ERROR: pipe mode requires a binary standard output.",
+              file=sys.stderr)
+        return -1
     
-    marker_color = None
-    if not args.disable_marker:
+    if not os.path.exists(conf.output_directory) and not conf.pipe:
         try:
-            marker_color = colorparse.parse(args.marker_color)
-        except (colorparse.ColorFormatError, colorparse.ColorValueError) as err:
-            print("ERROR: " + err.message, file=sys.stderr)
-            return -1
-
-    timestamp_color = None
-    if not args.disable_timestamp:
-        try:
-            timestamp_color = colorparse.parse(args.timestamp_color)
-        except (colorparse.ColorFormatError, colorparse.ColorValueError) as err:
-            print("ERROR: " + err.message, file=sys.stderr)
-            return -1
-    
-    if not os.path.exists(args.output_directory) and not args.pipe:
-        try:
-            os.mkdir(args.output_directory)
+            os.mkdir(conf.output_directory)
         except Exception as err:
             print("ERROR: " + err.message, file=sys.stderr)
             return -1
 
-    if not (args.rotation == 0 or args.rotation == 90 or
-            args.rotation == 180 or args.rotation == 270 or args.rotation == -90):
-            print("ERROR: invalid --rotation arg: specify 0 or 90 or 180 or 270 or -90.")
-            return -1
-
     for detection_result_file in args.detection_result_file:
-        make_digest_movie(detection_result_file,
-                          marker_color, args.marker_thickness,
-                          timestamp_color, args.timestamp_font_scale,
-                          args.gamma, args.cue)
+        make_digest_movie(detection_result_file, conf)
 
     return 0
 
@@ -0,0 +1,102 @@
+import os
+import sys
+import tracemalloc
+import typing
+
+MIB = 1024 * 1024
+
+def current_rss() -> typing.Optional[int]:
+    """
+    現在の常駐メモリ量（RSS）
+    :return: バイト数（取得できない場合は None）
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+def peak_rss(children: bool = False) -> typing.Optional[int]:
+    """
+    プロセス開始からの常駐メモリ量（RSS）の最大値
+    OpenCV 内部で確保されたメモリも含む
+    :param bool children: 終了した子プロセス（ffmpeg など）のうち最大のものを返すか
+    :return: バイト数（取得できない場合は None）
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux は KiB 単位、macOS はバイト単位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class MemoryProfiler:
+    """
+    フレーム毎に一時的に確保されるメモリ量の計測
+    `tracemalloc` で Python/numpy が確保したメモリを追跡する（OpenCV 内部で確保されるメモリは含まない）
+    計測するのはフレーム処理中の使用量のピークの増分なので、確保と解放を繰り返した場合も
+    同時に確保されていた量だけを数える（割り当ての延べ量ではない）
+
+        profiler = MemoryProfiler()
+        profiler.start()
+        for frame in frames:
+            profiler.begin_frame()
+            process(frame)
+            profiler.end_frame()
+        print(profiler.report())
+    """
+    def __init__(self):
+        self.frames = 0
+        self.first_transient = 0
+        self.total_transient = 0
+        self.max_transient = 0
+        self.first_current = None
+        self.last_current = 0
+        self.peak = 0
+        self._frame_start = 0
+
+    def start(self):
+        tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def begin_frame(self):
+        self._frame_start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+    def end_frame(self):
+        current, peak = tracemalloc.get_traced_memory()
+        # フレーム処理中に一時的に確保された量（処理開始時点からのピーク増分）
+        transient = peak - self._frame_start
+        self.frames += 1
+        if self.frames == 1:
+            # 初回は作業用バッファの確保を含むので別に集計する
+            self.first_transient = transient
+        else:
+            self.total_transient += transient
+            self.max_transient = max(self.max_transient, transient)
+        self.peak = max(self.peak, peak)
+        if self.first_current is None:
+            self.first_current = current
+        self.last_current = current
+
+    def report(self) -> str:
+        if self.frames == 0:
+            return "memory profile: no frames"
+        mib = 1024 * 1024
+        lines = [
+            "memory profile: {} frames".format(self.frames),
+            "  transient peak in first frame:   {:.2f} MiB".format(
+                self.first_transient / mib),
+            "  transient peak per frame (mean): {:.2f} MiB".format(
+                self.total_transient / max(self.frames - 1, 1) / mib),
+            "  transient peak per frame (max):  {:.2f} MiB".format(
+                self.max_transient / mib),
+            "  traced peak:                     {:.2f} MiB".format(self.peak / mib),
+            "  retained growth:                 {:.2f} MiB".format(
+                (self.last_current - self.first_current) / mib),
+        ]
+        return "\n".join(lines)
@@ -0,0 +1,216 @@
+import json
+import sys
+import time
+import typing
+
+# 処理時間のヒストグラムのバケット境界（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """
+    処理時間の集計（回数・合計・最小・最大・バケット毎の度数）
+    """
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        i = 0
+        for b in self.buckets:
+            if value <= b:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'buckets': {str(b): c for b, c in zip(self.buckets + ('+Inf',),
+                                                  self._cumulative())},
+        }
+
+    def _cumulative(self) -> typing.List[int]:
+        result = []
+        total = 0
+        for c in self.counts:
+            total += c
+            result.append(total)
+        return result
+
+
+class _Stage:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    処理段階毎の処理時間と件数の計測
+
+        m = Metrics()
+        with m.stage("decode"):
+            frame = read()
+        m.count("frames")
+        m.write("metrics.json")
+
+    計測しない場合は `NULL`（何もしない実装）を渡す
+    """
+    enabled = True
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._stages = {}
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def _histogram(self, name: str) -> Histogram:
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram(self.buckets)
+        return h
+
+    def stage(self, name: str) -> _Stage:
+        """
+        処理段階の計測（`with` 文で使う）
+        :param str name: 処理段階の名前
+        """
+        s = self._stages.get(name)
+        if s is None:
+            s = self._stages[name] = _Stage(self._histogram(name))
+        return s
+
+    def observe(self, name: str, seconds: float):
+        """
+        計測済みの処理時間の記録
+        :param str name: 処理段階の名前
+        :param float seconds: 処理時間（秒）
+        """
+        self._histogram(name).observe(seconds)
+
+    def count(self, name: str, n: int = 1):
+        """
+        件数の加算
+        :param str name: カウンタの名前
+        :param int n: 加算する値
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self) -> dict:
+        wall = time.perf_counter() - self._wall_start
+        cpu = time.process_time() - self._cpu_start
+        return {
+            # CPU 時間が経過時間より十分小さい場合は I/O 待ちが多い
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'counters': dict(self.counters),
+            'stages': {k: h.to_dict() for k, h in self.histograms.items()},
+        }
+
+    def prometheus_text(self, prefix: str = "smd") -> str:
+        """
+        Prometheus のテキスト形式での出力
+        """
+        d = self.to_dict()
+        lines = [
+            "# TYPE {}_wall_seconds gauge".format(prefix),
+            "{}_wall_seconds {}".format(prefix, d['wall_seconds']),
+            "# TYPE {}_cpu_seconds gauge".format(prefix),
+            "{}_cpu_seconds {}".format(prefix, d['cpu_seconds']),
+        ]
+        for name, value in sorted(self.counters.items()):
+            lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+            lines.append("{}_{}_total {}".format(prefix, name, value))
+        metric = prefix + "_stage_seconds"
+        lines.append("# TYPE {} histogram".format(metric))
+        for name, h in sorted(self.histograms.items()):
+            for le, c in zip(h.buckets + ('+Inf',), h._cumulative()):
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                    metric, name, le, c))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(metric, name, h.sum))
+            lines.append('{}_count{{stage="{}"}} {}'.format(metric, name, h.count))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        人が読むための集計結果
+        """
+        d = self.to_dict()
+        lines = ["metrics: wall {:.2f} s, cpu {:.2f} s".format(
+            d['wall_seconds'], d['cpu_seconds'])]
+        for name, value in sorted(self.counters.items()):
+            lines.append("  {:<10} {}".format(name, value))
+        for name, h in self.histograms.items():
+            lines.append("  {:<10} {:8.3f} s  {:6d} calls  mean {:8.2f} ms  max {:8.2f} ms".format(
+                name, h.sum, h.count, h.sum / h.count * 1000, h.max * 1000))
+        return "\n".join(lines)
+
+    def write(self, path: str, format: str = "json"):
+        """
+        計測結果の書き出し
+        :param str path: 出力ファイルパス（`-` の場合は標準出力）
+        :param str format: `json` または `prometheus`
+        """
+        if format == "prometheus":
+            text = self.prometheus_text()
+        else:
+            text = json.dumps(self.to_dict(), indent=2) + "\n"
+        if path == '-':
+            sys.stdout.write(text)
+        else:
+            with open(path, mode='w') as f:
+                f.write(text)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullMetrics:
+    """
+    計測しない場合の `Metrics` の代わり（何もしない）
+    """
+    enabled = False
+
+    _stage = _NullStage()
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def observe(self, name: str, seconds: float):
+        pass
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+
+NULL = NullMetrics()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import struct
+import zlib
+
+from lazyimport import lazy_import
+numpy = lazy_import('numpy')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+class PNGWriter:
+    """
+    PNG ファイル（RGB 8bit）の書き出し
+    画像全体を保持せずに、上から順に横長のストリップ毎に書き出せる
+
+        with PNGWriter(filepath, width, height) as writer:
+            for y in range(0, height, rows):
+                writer.write(bgr_img[y : y + rows])
+
+    :param str filepath: 出力ファイルパス
+    :param int width: 画像の幅
+    :param int height: 画像の高さ
+    :param int level: zlib の圧縮レベル
+    """
+    def __init__(self, filepath: str, width: int, height: int, level: int = 1):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._compressor = zlib.compressobj(level)
+        self._f = open(filepath, 'wb')
+        self._f.write(PNG_SIGNATURE)
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                         8, 2, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _chunk(self, chunk_type: bytes, data: bytes):
+        self._f.write(struct.pack('>I', len(data)))
+        self._f.write(chunk_type)
+        self._f.write(data)
+        self._f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def write(self, img: numpy.array):
+        """
+        ストリップの書き出し
+        :param numpy.array img: 画像の続きの行（BGR）
+        """
+        rows, width = img.shape[:2]
+        if width != self.width or self.rows + rows > self.height:
+            raise ValueError("strip does not fit the image: {}x{}".format(
+                width, rows))
+        # 各行の先頭はフィルタの種類（0: なし）、BGR から RGB への並べ替えは直接書き込む
+        buf = numpy.zeros((rows, 1 + width * 3), dtype=numpy.uint8)
+        buf[:, 1:].reshape(rows, width, 3)[...] = img[:, :, ::-1]
+        data = self._compressor.compress(buf)
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows += rows
+
+    def close(self):
+        if self._f is None:
+            return
+        try:
+            if self.rows == self.height:
+                self._chunk(b'IDAT', self._compressor.flush())
+                self._chunk(b'IEND', b'')
+        finally:
+            self._f.close()
+            self._f = None
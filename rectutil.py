@@ -0,0 +1,83 @@
+import typing
+
+# 矩形は `cv2.boundingRect()` と同じ `(x, y, w, h)` 形式で扱う
+Rect = typing.Tuple[int, int, int, int]
+
+def clip_rect(rect: Rect, width: int, height: int) -> typing.Optional[Rect]:
+    """
+    矩形を画像の範囲に収める
+    :param rect: 矩形 `(x, y, w, h)`
+    :param int width: 画像の幅
+    :param int height: 画像の高さ
+    :return: 画像内に収めた矩形（画像と重ならない場合は None）
+    """
+    x, y, w, h = rect
+    left = max(x, 0)
+    top = max(y, 0)
+    right = min(x + w, width)
+    bottom = min(y + h, height)
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right - left, bottom - top)
+
+def intersects(a: Rect, b: Rect) -> bool:
+    """
+    二つの矩形が重なる(接する)かどうか
+    :param a: 矩形
+    :param b: 矩形
+    :return: 重なる場合は True
+    """
+    return (a[0] <= b[0] + b[2] and b[0] <= a[0] + a[2] and
+            a[1] <= b[1] + b[3] and b[1] <= a[1] + a[3])
+
+def merge_rects(rects: typing.Iterable[Rect]) -> typing.List[Rect]:
+    """
+    重なり合う(接する)矩形を外接矩形にまとめる
+    :param rects: 矩形リスト
+    :return: 互いに重ならない矩形リスト
+    """
+    merged = [list(r) for r in rects]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for r in merged:
+            for m in result:
+                if intersects(r, m):
+                    left = min(r[0], m[0])
+                    top = min(r[1], m[1])
+                    m[2] = max(r[0] + r[2], m[0] + m[2]) - left
+                    m[3] = max(r[1] + r[3], m[1] + m[3]) - top
+                    m[0] = left
+                    m[1] = top
+                    changed = True
+                    break
+            else:
+                result.append(r)
+        merged = result
+    return [tuple(r) for r in merged]
+
+def line_rect(line, margin: int = 0) -> Rect:
+    """
+    `cv2.HoughLinesP()` の直線 `[ [x1, y1, x2, y2] ]` を囲む矩形
+    :param line: 直線
+    :param int margin: 上下左右に広げる幅（マーカーの線の太さなど）
+    :return: 矩形
+    """
+    x1, y1, x2, y2 = line[0]
+    left = min(x1, x2) - margin
+    top = min(y1, y2) - margin
+    return (int(left), int(top),
+            int(abs(x2 - x1) + 2 * margin + 1),
+            int(abs(y2 - y1) + 2 * margin + 1))
+
+def marker_rects(lines, thickness: int) -> typing.List[Rect]:
+    """
+    直線リストの各直線に描画するマーカー矩形の描画範囲
+    :param lines: `cv2.HoughLinesP()` 形式の直線リスト
+    :param int thickness: マーカーの線の太さ
+    :return: 矩形リスト
+    """
+    if lines is None:
+        return []
+    return [line_rect(line, thickness + 1) for line in lines]
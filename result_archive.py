@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import typing
+
+from lazyimport import lazy_import
+numpy = lazy_import('numpy')
+resultstore = lazy_import('resultstore')
+
+import version
+
+def load_all(paths: typing.List[str]) -> resultstore.ResultStore:
+    stores = [resultstore.load(path) for path in paths]
+    if len(stores) == 1:
+        return stores[0]
+    return resultstore.ResultStore.concat(stores)
+
+def select(store: resultstore.ResultStore, args) -> resultstore.ResultStore:
+    if args.start is None and args.end is None and args.file is None and \
+       args.min_frame is None and args.max_frame is None:
+        return store
+    return store.select(args.start, args.end, args.file,
+                        args.min_frame, args.max_frame)
+
+def command_merge(args) -> int:
+    store = select(load_all(args.input), args)
+    store.save(args.output, args.compress)
+    print("{}: {} detections, {} files".format(args.output, len(store),
+                                               len(store.files())))
+    return 0
+
+def command_export(args) -> int:
+    store = select(load_all(args.input), args)
+    entries = store.entries()
+    if args.output == '-':
+        json.dump(entries, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, mode='w') as f:
+            json.dump(entries, f, indent=2)
+    return 0
+
+def command_hourly(args) -> int:
+    store = select(load_all(args.input), args)
+    hours, counts = store.hourly_counts()
+    for h, c in zip(hours, counts):
+        print("{},{}".format(numpy.datetime_as_string(h, unit='h'), c))
+    return 0
+
+def command_info(args) -> int:
+    store = load_all(args.input)
+    timestamps = store.detections['timestamp']
+    timestamps = timestamps[~numpy.isnat(timestamps)]
+    print("detections: {}".format(len(store)))
+    print("lines:      {}".format(len(store.lines)))
+    print("files:      {}".format(len(store.files())))
+    if len(timestamps):
+        print("period:     {} - {}".format(
+            numpy.datetime_as_string(timestamps[0], unit='s'),
+            numpy.datetime_as_string(timestamps[-1], unit='s')))
+    return 0
+
+def add_input_arguments(parser, with_filter: bool = True):
+    parser.add_argument("input", nargs='+',
+                        help="result files (.json, .jsonl or .npz).")
+    if with_filter:
+        parser.add_argument("--start", default=None,
+                            help="'YYYY-MM-DDThh:mm:ss' format (inclusive).")
+        parser.add_argument("--end", default=None,
+                            help="'YYYY-MM-DDThh:mm:ss' format (exclusive).")
+        parser.add_argument("--file", default=None)
+        parser.add_argument("--min-frame", type=int, default=None)
+        parser.add_argument("--max-frame", type=int, default=None)
+
+def main(argv: typing.List[str]) -> int:
+    parser = argparse.ArgumentParser(description=version.version_string(__file__))
+    subparsers = parser.add_subparsers(dest="command")
+
+    p = subparsers.add_parser("merge", help="merge and filter result files into an archive.")
+    p.add_argument("output", help="output file (.npz).")
+    add_input_arguments(p)
+    p.add_argument("--compress", action="store_true")
+    p.set_defaults(func=command_merge)
+
+    p = subparsers.add_parser("export", help="export results as JSON.")
+    add_input_arguments(p)
+    p.add_argument("--output", default='-', help="'-' for stdout.")
+    p.set_defaults(func=command_export)
+
+    p = subparsers.add_parser("hourly", help="count detections per hour.")
+    add_input_arguments(p)
+    p.set_defaults(func=command_hourly)
+
+    p = subparsers.add_parser("info", help="show summary of results.")
+    add_input_arguments(p, with_filter=False)
+    p.set_defaults(func=command_info)
+
+    args = parser.parse_args(argv[1:])
+    if args.command is None:
+        parser.print_help()
+        return -1
+
+    try:
+        return args.func(args)
+    except (OSError, ValueError) as err:
+        print("ERROR: " + str(err), file=sys.stderr)
+        return -1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
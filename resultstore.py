@@ -0,0 +1,343 @@
+from __future__ import annotations
+
+import datetime
+import json
+import re
+import typing
+
+from lazyimport import lazy_import
+numpy = lazy_import('numpy')
+
+FORMAT_VERSION = 1
+
+# 検出結果1件分の列
+# 文字列は `strings` の番号で持つ（-1 は None）
+DETECTION_DTYPE = numpy.dtype([
+    ('timestamp', 'datetime64[us]'), # 撮影時刻 + 動画の再生時間
+    ('file', numpy.int32),
+    ('frame', numpy.int64),
+    ('time', numpy.int64),           # 動画の再生時間（マイクロ秒、写真の場合は NO_TIME）
+    ('creation_time', numpy.int32),
+    ('snapshot', numpy.int32),
+    ('clip', numpy.int32),
+    ('line_start', numpy.int64),     # `lines` の開始位置
+    ('line_count', numpy.int32),
+])
+
+NAT = numpy.datetime64('NaT', 'us')
+
+# 再生時間がない（写真の）場合の `time` の値
+NO_TIME = -1
+
+# `str(datetime.timedelta)` の形式（`1 day, 1:00:01.500000`・`-1 day, 23:59:59` など）
+TIME_PATTERN = re.compile(r"(?:(-?\d+) days?, )?(\d+):(\d+):(\d+)(?:\.(\d+))?$")
+
+def parse_creation_time(creation_time: typing.Optional[str]) -> typing.Optional[datetime.datetime]:
+    """
+    撮影時刻の文字列の解析
+    写真の EXIF 形式（`2014:12:14 23:46:36`）と ISO 8601 形式に対応する
+    タイムゾーンを考慮しないカメラがあるため、タイムゾーンは無視して記録されたままの時刻とする
+    :param str creation_time: 撮影時刻
+    :return: 撮影時刻（解析できない場合は None）
+    """
+    if not creation_time:
+        return None
+    try:
+        return datetime.datetime.strptime(creation_time, "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        pass
+    s = creation_time.replace('Z', '+00:00')
+    try:
+        return datetime.datetime.fromisoformat(s).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+def parse_time(time_str: typing.Optional[str]) -> int:
+    """
+    再生時間の文字列（`str(datetime.timedelta)` 形式）をマイクロ秒に変換
+    24時間以上（`1 day, 1:00:01.5`）と負の時間（`-1 day, 23:59:59`）の日数にも対応する
+    :return: マイクロ秒（時間がない場合は NO_TIME）
+    """
+    if time_str is None or time_str == "None":
+        return NO_TIME
+    m = TIME_PATTERN.match(time_str.strip())
+    if m is None:
+        raise ValueError("invalid time: " + time_str)
+    days, h, mi, sec, frac = m.groups()
+    return (((int(days or 0) * 24 + int(h)) * 60 + int(mi)) * 60 + int(sec)) \
+        * 1000000 + int(frac.ljust(6, "0")[:6] if frac else 0)
+
+def load_json(path: str) -> typing.List[dict]:
+    """
+    detect_meteor.py の結果ファイル（JSON）または detect_meteor_live.py の結果ファイル（JSON Lines）の読み込み
+    :param str path: 結果ファイルパス
+    :return: 検出結果リスト
+    """
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+class ResultStore:
+    """
+    検出結果の列指向の保存形式
+    検出結果を列毎の numpy 配列（構造化配列）で持ち、`.npz` ファイルに保存する
+    検出結果は撮影時刻順に並べ、期間・ファイル・フレーム番号で絞り込める
+
+        store = ResultStore.from_entries(resultstore.load_json("result_a.mov.json"))
+        store.save("archive.npz")
+        store = ResultStore.load("archive.npz")
+        hours, counts = store.select(start="2021-12-14").hourly_counts()
+
+    :param numpy.array detections: 検出結果（`DETECTION_DTYPE` の配列）
+    :param numpy.array lines: 検出した直線 `(N, 4)`
+    :param strings: 文字列表
+    """
+    def __init__(self, detections: numpy.array, lines: numpy.array,
+                 strings: typing.Sequence[str]):
+        self.detections = detections
+        self.lines = lines
+        self.strings = list(strings)
+
+    def __len__(self) -> int:
+        return len(self.detections)
+
+    @classmethod
+    def empty(cls) -> "ResultStore":
+        return cls(numpy.empty(0, dtype=DETECTION_DTYPE),
+                   numpy.empty((0, 4), dtype=numpy.int32), [])
+
+    @classmethod
+    def from_entries(cls, entries: typing.Iterable[dict]) -> "ResultStore":
+        """
+        JSON の検出結果リストからの作成
+        :param entries: 検出結果リスト
+        :return: ResultStore
+        """
+        strings = []
+        string_index = {}
+        def intern(s):
+            if s is None:
+                return -1
+            i = string_index.get(s)
+            if i is None:
+                i = string_index[s] = len(strings)
+                strings.append(s)
+            return i
+
+        entries = list(entries)
+        detections = numpy.empty(len(entries), dtype=DETECTION_DTYPE)
+        line_count = sum(len(e['lines']) for e in entries)
+        lines = numpy.empty((line_count, 4), dtype=numpy.int32)
+        pos = 0
+        for i, e in enumerate(entries):
+            time_us = parse_time(e.get('time'))
+            creation_time = e.get('creation_time')
+            t = parse_creation_time(creation_time)
+            if t is None:
+                timestamp = NAT
+            else:
+                if time_us != NO_TIME:
+                    t += datetime.timedelta(microseconds=time_us)
+                timestamp = numpy.datetime64(t, 'us')
+            n = len(e['lines'])
+            if n:
+                lines[pos : pos + n] = numpy.array(e['lines'],
+                                                   dtype=numpy.int32).reshape(n, 4)
+            detections[i] = (timestamp, intern(e['file']), e.get('frame', 0),
+                             time_us, intern(creation_time),
+                             intern(e.get('snapshot')), intern(e.get('clip')),
+                             pos, n)
+            pos += n
+        return cls(detections, lines, strings)._sorted()
+
+    def _sorted(self) -> "ResultStore":
+        # 撮影時刻、ファイル、フレーム番号の順に並べる（撮影時刻のないものは最後）
+        d = self.detections
+        order = numpy.lexsort((d['frame'], d['file'],
+                               d['timestamp'].view(numpy.int64),
+                               numpy.isnat(d['timestamp'])))
+        return self._take(order)
+
+    def _take(self, index: numpy.array) -> "ResultStore":
+        """
+        指定した番号の検出結果だけを取り出す（直線と文字列表も詰め直す）
+        """
+        d = self.detections[index]
+        counts = d['line_count'].astype(numpy.int64)
+        starts = numpy.zeros(len(d), dtype=numpy.int64)
+        if len(d):
+            starts[1:] = numpy.cumsum(counts)[:-1]
+        total = int(counts.sum())
+        # 各直線の元の位置
+        src = numpy.repeat(d['line_start'] - starts, counts) + \
+            numpy.arange(total, dtype=numpy.int64)
+        lines = self.lines[src]
+        d['line_start'] = starts
+        # 使われている文字列だけを残す
+        columns = ('file', 'creation_time', 'snapshot', 'clip')
+        used = numpy.unique(numpy.concatenate([d[c] for c in columns]))
+        used = used[used >= 0]
+        remap = numpy.full(len(self.strings) + 1, -1, dtype=numpy.int32)
+        remap[used] = numpy.arange(len(used), dtype=numpy.int32)
+        for c in columns:
+            d[c] = remap[d[c]]
+        return ResultStore(d, lines, [self.strings[i] for i in used])
+
+    @classmethod
+    def concat(cls, stores: typing.Iterable["ResultStore"]) -> "ResultStore":
+        """
+        複数の ResultStore の結合
+        同じファイル・フレーム番号・撮影時刻の検出結果は後のものを残す
+        """
+        strings = []
+        string_index = {}
+        detections = []
+        lines = []
+        line_pos = 0
+        for s in stores:
+            remap = numpy.empty(len(s.strings) + 1, dtype=numpy.int32)
+            remap[-1] = -1
+            for i, x in enumerate(s.strings):
+                j = string_index.get(x)
+                if j is None:
+                    j = string_index[x] = len(strings)
+                    strings.append(x)
+                remap[i] = j
+            d = s.detections.copy()
+            for c in ('file', 'creation_time', 'snapshot', 'clip'):
+                d[c] = remap[d[c]]
+            d['line_start'] += line_pos
+            line_pos += len(s.lines)
+            detections.append(d)
+            lines.append(s.lines)
+        if not detections:
+            return cls.empty()
+        merged = cls(numpy.concatenate(detections), numpy.concatenate(lines),
+                     strings)
+        # 重複の除去（後から追加したものを優先）
+        d = merged.detections
+        keys = numpy.empty(len(d), dtype=[('file', numpy.int32),
+                                          ('frame', numpy.int64),
+                                          ('time', numpy.int64),
+                                          ('timestamp', numpy.int64)])
+        for c in ('file', 'frame', 'time'):
+            keys[c] = d[c]
+        # ライブ検出では実行毎にフレーム番号が 0 から始まるので撮影時刻も比べる
+        keys['timestamp'] = d['timestamp'].view(numpy.int64)
+        _, last = numpy.unique(keys[::-1], return_index=True)
+        keep = numpy.sort(len(d) - 1 - last)
+        return merged._take(keep)._sorted()
+
+    def select(self, start=None, end=None, file: typing.Optional[str] = None,
+               min_frame: typing.Optional[int] = None,
+               max_frame: typing.Optional[int] = None) -> "ResultStore":
+        """
+        検出結果の絞り込み
+        :param start: 撮影時刻の開始（この時刻を含む、`numpy.datetime64` に変換できるもの）
+        :param end: 撮影時刻の終了（この時刻を含まない）
+        :param str file: ファイルパス（末尾が一致するもの）
+        :param int min_frame: フレーム番号の下限
+        :param int max_frame: フレーム番号の上限
+        :return: 絞り込んだ ResultStore
+        """
+        d = self.detections
+        lo = 0
+        hi = len(d)
+        # 撮影時刻順に並んでいるので二分探索で範囲を決める
+        valid = hi - int(numpy.count_nonzero(numpy.isnat(d['timestamp'])))
+        timestamps = d['timestamp'][:valid]
+        if start is not None:
+            lo = int(numpy.searchsorted(timestamps,
+                                        numpy.datetime64(start, 'us'), 'left'))
+        if end is not None:
+            hi = int(numpy.searchsorted(timestamps,
+                                        numpy.datetime64(end, 'us'), 'left'))
+        elif start is not None:
+            hi = valid
+        mask = numpy.zeros(len(d), dtype=bool)
+        mask[lo:hi] = True
+        if file is not None:
+            codes = [i for i, s in enumerate(self.strings)
+                     if s == file or s.endswith("/" + file)]
+            mask &= numpy.isin(d['file'], codes)
+        if min_frame is not None:
+            mask &= d['frame'] >= min_frame
+        if max_frame is not None:
+            mask &= d['frame'] <= max_frame
+        return self._take(numpy.flatnonzero(mask))
+
+    def hourly_counts(self) -> typing.Tuple[numpy.array, numpy.array]:
+        """
+        1時間毎の検出数
+        :return: (時刻 `datetime64[h]` の配列, 検出数の配列)
+        """
+        t = self.detections['timestamp']
+        t = t[~numpy.isnat(t)].astype('datetime64[h]')
+        return numpy.unique(t, return_counts=True)
+
+    def files(self) -> typing.List[str]:
+        return [self.strings[i] for i in numpy.unique(self.detections['file'])]
+
+    def _string(self, i: int) -> typing.Optional[str]:
+        return self.strings[i] if i >= 0 else None
+
+    def entry(self, i: int) -> dict:
+        """
+        i 番目の検出結果を detect_meteor.py の JSON と同じ形式で取り出す
+        """
+        d = self.detections[i]
+        time_us = int(d['time'])
+        start = int(d['line_start'])
+        lines = self.lines[start : start + int(d['line_count'])]
+        entry = {}
+        entry['file'] = self._string(d['file'])
+        entry['time'] = str(datetime.timedelta(microseconds=time_us)
+                            if time_us != NO_TIME else None)
+        entry['frame'] = int(d['frame'])
+        entry['creation_time'] = self._string(d['creation_time'])
+        entry['lines'] = lines.reshape(-1, 1, 4).tolist()
+        entry['snapshot'] = self._string(d['snapshot'])
+        if d['clip'] >= 0:
+            entry['clip'] = self._string(d['clip'])
+        return entry
+
+    def entries(self) -> typing.List[dict]:
+        return [self.entry(i) for i in range(len(self))]
+
+    def save(self, path: str, compress: bool = False):
+        """
+        `.npz` ファイルへの保存
+        :param str path: 出力ファイルパス
+        :param bool compress: 圧縮するか（小さくなるが読み込みが遅くなる）
+        """
+        save = numpy.savez_compressed if compress else numpy.savez
+        with open(path, mode='wb') as f:
+            save(f, version=numpy.array(FORMAT_VERSION),
+                 detections=self.detections, lines=self.lines,
+                 strings=numpy.array(self.strings, dtype=str))
+
+    @classmethod
+    def load(cls, path: str) -> "ResultStore":
+        """
+        `.npz` ファイルの読み込み
+        :param str path: ファイルパス
+        :return: ResultStore
+        """
+        with numpy.load(path, allow_pickle=False) as z:
+            version = int(z['version'])
+            if version > FORMAT_VERSION:
+                raise ValueError("unsupported result store version: {}".format(version))
+            return cls(z['detections'], z['lines'], z['strings'].tolist())
+
+
+def load(path: str) -> ResultStore:
+    """
+    結果ファイル（`.npz`、`.json`、`.jsonl`）の読み込み
+    :param str path: ファイルパス
+    :return: ResultStore
+    """
+    if path.endswith(".npz"):
+        return ResultStore.load(path)
+    return ResultStore.from_entries(load_json(path))
@@ -1,18 +1,39 @@
-import cv2
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
 
-def draw(dest_img, color, draw_func):
+import rectutil
+
+def draw(dest_img, color, draw_func, rects=None):
+    """
+    半透明色に対応した描画
+    :param dest_img: 描画先画像（直接書き換える）
+    :param color: `(B, G, R)` または `(B, G, R, A)`
+    :param draw_func: `draw_func(img, (B, G, R))` 形式の描画関数
+    :param rects: `draw_func` が描画する範囲の矩形 `(x, y, w, h)` のリスト
+                  (半透明合成をこの範囲に限定する。None の場合は画像全体)
+    :return: 描画後の画像
+    """
     rgb = (color[0], color[1], color[2])
-    
-    h, w, c = dest_img.shape
-    img = dest_img
-    if len(color) == 4:
-        img = dest_img.copy()
-    
-    draw_func(img, rgb)
-    
-    if img is not dest_img:
-        alpha = float(color[3]) / 255
-        beta = 1.0 - alpha
-        dest_img = cv2.addWeighted(dest_img, beta, img, alpha, 1.0)
+
+    if len(color) != 4:
+        draw_func(dest_img, rgb)
+        return dest_img
+
+    h, w = dest_img.shape[:2]
+    if rects is None:
+        rects = [(0, 0, w, h)]
+    rects = [r for r in (rectutil.clip_rect(r, w, h) for r in rects)
+             if r is not None]
+    rects = rectutil.merge_rects(rects)
+
+    # 描画範囲だけを退避してから直接描画し、その範囲だけを合成する
+    saved = [dest_img[y : y + rh, x : x + rw].copy() for x, y, rw, rh in rects]
+    draw_func(dest_img, rgb)
+
+    alpha = float(color[3]) / 255
+    beta = 1.0 - alpha
+    for (x, y, rw, rh), orig in zip(rects, saved):
+        roi = dest_img[y : y + rh, x : x + rw]
+        cv2.addWeighted(orig, beta, roi, alpha, 0.0, dst=roi)
 
     return dest_img
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import getpass
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import time
+import traceback
+import typing
+
+import version
+
+# サブコマンド名: (モジュール名, 説明)
+COMMANDS = {
+    "detect": ("detect_meteor", "detect meteors in photos or a video."),
+    "tune": ("detector_tuner", "tune detection parameters with an image."),
+    "digest": ("make_digest_movie", "make a digest movie from a result file."),
+    "composite": ("lighten_only_composite", "make a lighten-only composite of a video."),
+    "live": ("detect_meteor_live", "detect meteors from a camera or stream."),
+    "results": ("result_archive", "merge and aggregate result files."),
+    "bench": ("benchmark", "measure speed and accuracy with a synthetic video."),
+}
+
+# サーバーで実行しないサブコマンド（標準入力を読む・終了しない）
+LOCAL_ONLY_COMMANDS = ("live",)
+
+# サーバーで実行しないオプション（標準出力にバイナリを書き出す）
+LOCAL_ONLY_OPTIONS = {
+    "digest": ("--pipe",),
+}
+
+def local_only_option(argv: typing.List[str]) -> typing.Optional[str]:
+    """
+    サーバーで実行できないオプションの検出
+    :param argv: サブコマンドと引数
+    :return: オプション名（ない場合は None）
+    """
+    for option in LOCAL_ONLY_OPTIONS.get(argv[0], ()):
+        for arg in argv[1:]:
+            if arg == "--":
+                break
+            # argparse は省略形（`--pi`）も受け付ける
+            name = arg.split("=", 1)[0]
+            if len(name) > 2 and option.startswith(name):
+                return option
+    return None
+
+def default_socket_path() -> str:
+    return os.path.join(tempfile.gettempdir(),
+                        "smd-{}.sock".format(getpass.getuser()))
+
+def run_command(command: str, argv: typing.List[str]) -> int:
+    """
+    サブコマンドの実行
+    各コマンドのモジュールは実行時に読み込む
+    :param str command: サブコマンド名
+    :param argv: サブコマンドの引数
+    :return: 終了ステータス
+    """
+    module = importlib.import_module(COMMANDS[command][0])
+    # ヘルプの usage に `smd.py detect` のように表示する
+    prog = sys.argv[0]
+    sys.argv[0] = "{} {}".format(os.path.basename(prog), command)
+    try:
+        status = module.main([sys.argv[0]] + argv)
+    except SystemExit as e:
+        status = e.code
+    finally:
+        sys.argv[0] = prog
+    if status is None:
+        return 0
+    if not isinstance(status, int):
+        print(status, file=sys.stderr)
+        return 1
+    return status
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """
+    ジョブの受け付け
+    1行の JSON `{"argv": [...], "cwd": ...}` を受け取ってサブコマンドを実行し、
+    1行の JSON `{"status": ..., "stdout": ..., "stderr": ...}` を返す
+    """
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            return
+        if request.get("shutdown"):
+            self.reply({"status": 0, "stdout": "", "stderr": ""})
+            self.server.running = False
+            return
+        self.reply(self.server.run_job(request.get("argv", []),
+                                       request.get("cwd")))
+
+    def reply(self, response: dict):
+        self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+
+
+# UNIX ドメインソケットのない環境でも他のサブコマンドは使えるようにする
+class JobServer(getattr(socketserver, "UnixStreamServer", object)):
+    """
+    常駐して、ローカルのソケットで受け付けたジョブを1つずつ実行するサーバー
+    cv2・numpy などを読み込んだ状態で待機するので、ジョブ毎の起動時間がかからない
+    :param str path: ソケットファイルのパス
+    :param bool verbose: 実行したジョブを表示するか
+    """
+    def __init__(self, path: str, verbose: bool = False):
+        self.path = path
+        self.verbose = verbose
+        self.running = True
+        # 他のユーザーからジョブを受け付けない
+        # bind() の後に chmod すると、その間は他のユーザーが接続できてしまうので、
+        # 最初から 0600 で作成されるように umask を設定して bind() する
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, JobHandler)
+        finally:
+            os.umask(umask)
+
+    def run_job(self, argv: typing.List[str],
+                cwd: typing.Optional[str]) -> dict:
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        start = time.perf_counter()
+        if not argv or argv[0] not in COMMANDS:
+            print("ERROR: unknown command: " + " ".join(argv[:1]), file=stderr)
+            status = -1
+        elif argv[0] in LOCAL_ONLY_COMMANDS:
+            print("ERROR: not supported in server mode: " + argv[0],
+                  file=stderr)
+            status = -1
+        elif local_only_option(argv):
+            print("ERROR: not supported in server mode: {} {}".format(
+                argv[0], local_only_option(argv)), file=stderr)
+            status = -1
+        else:
+            saved_cwd = os.getcwd()
+            try:
+                with contextlib.redirect_stdout(stdout), \
+                     contextlib.redirect_stderr(stderr):
+                    try:
+                        if cwd:
+                            os.chdir(cwd)
+                        status = run_command(argv[0], argv[1:])
+                    except Exception:
+                        traceback.print_exc()
+                        status = 1
+            finally:
+                os.chdir(saved_cwd)
+        if self.verbose:
+            print("{} ({:.3f}s): {}".format(status, time.perf_counter() - start,
+                                            " ".join(argv)), flush=True)
+        return {"status": status, "stdout": stdout.getvalue(),
+                "stderr": stderr.getvalue()}
+
+    def serve(self):
+        while self.running:
+            self.handle_request()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def preload():
+    """
+    重いモジュールの読み込み（サーバーの起動時）
+    """
+    import cv2
+    import numpy
+    # 遅延読み込みのモジュールは属性の参照で読み込まれる
+    cv2.__version__
+    numpy.__version__
+    for module_name, _ in COMMANDS.values():
+        importlib.import_module(module_name)
+
+def request(message: dict, socket_path: str) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + "\n").encode('utf-8'))
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("no response from server: " + socket_path)
+    return json.loads(line.decode('utf-8'))
+
+def submit(argv: typing.List[str], socket_path: typing.Optional[str] = None,
+           cwd: typing.Optional[str] = None) -> typing.Tuple[int, str, str]:
+    """
+    サーバーへのジョブの送信
+    :param argv: サブコマンドと引数（`["tune", "c1.png", ...]`）
+    :param str socket_path: ソケットファイルのパス
+    :param str cwd: ジョブを実行するディレクトリ（相対パスの基準）
+    :return: (終了ステータス, 標準出力, 標準エラー出力)
+    """
+    response = request({"argv": list(argv), "cwd": cwd or os.getcwd()},
+                       socket_path or default_socket_path())
+    return response["status"], response["stdout"], response["stderr"]
+
+def is_listening(socket_path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def command_serve(argv: typing.List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="smd.py serve",
+                                     description="run jobs submitted over a local socket.")
+    parser.add_argument("--socket", default=default_socket_path())
+    parser.add_argument("--verbose", action="store_true",
+                        help="print each job.")
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("ERROR: server mode is not supported on this platform.",
+              file=sys.stderr)
+        return -1
+    if os.path.exists(args.socket):
+        if is_listening(args.socket):
+            print("ERROR: server is already running: " + args.socket,
+                  file=sys.stderr)
+            return -1
+        # 前回のサーバーが残したソケットファイル
+        os.remove(args.socket)
+
+    preload()
+    try:
+        server = JobServer(args.socket, args.verbose)
+    except OSError as err:
+        print("ERROR: " + str(err), file=sys.stderr)
+        return -1
+    print("listening: " + args.socket, flush=True)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+def command_submit(argv: typing.List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="smd.py submit",
+                                     description="run a command on the server.")
+    parser.add_argument("--socket", default=default_socket_path())
+    parser.add_argument("command", choices=COMMANDS.keys())
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    try:
+        status, stdout, stderr = submit([args.command] + args.args, args.socket)
+    except OSError as err:
+        print("ERROR: cannot connect to server: {}: {}".format(args.socket, err),
+              file=sys.stderr)
+        return -1
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return status
+
+def command_stop(argv: typing.List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="smd.py stop",
+                                     description="stop the server.")
+    parser.add_argument("--socket", default=default_socket_path())
+    args = parser.parse_args(argv)
+
+    try:
+        request({"shutdown": True}, args.socket)
+    except OSError as err:
+        print("ERROR: cannot connect to server: {}: {}".format(args.socket, err),
+              file=sys.stderr)
+        return -1
+    return 0
+
+SERVER_COMMANDS = {
+    "serve": (command_serve, "run as a server and accept jobs over a local socket."),
+    "submit": (command_submit, "run a command on the server."),
+    "stop": (command_stop, "stop the server."),
+}
+
+def print_usage(file=sys.stdout):
+    print(version.version_string(__file__), file=file)
+    print("usage: smd.py <command> [args ...]\n\ncommands:", file=file)
+    for name, (_, description) in list(COMMANDS.items()) + \
+                                  list(SERVER_COMMANDS.items()):
+        print("  {:<10} {}".format(name, description), file=file)
+    print("\n'smd.py <command> -h' for help of each command.", file=file)
+
+def main(argv: typing.List[str]) -> int:
+    if len(argv) < 2 or argv[1] in ("-h", "--help"):
+        print_usage()
+        return 0 if len(argv) >= 2 else -1
+    command = argv[1]
+    if command in SERVER_COMMANDS:
+        return SERVER_COMMANDS[command][0](argv[2:])
+    if command not in COMMANDS:
+        print("ERROR: unknown command: " + command, file=sys.stderr)
+        print_usage(file=sys.stderr)
+        return -1
+    return run_command(command, argv[2:])
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import datetime
+import math
+import typing
+
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+numpy = lazy_import('numpy')
+ffmpeg = lazy_import('ffmpeg')
+
+class Meteor:
+    """
+    合成する流星
+    :param int start_frame: 出現フレーム
+    :param int frames: 継続フレーム数
+    :param start: 出現位置 `(x, y)`
+    :param velocity: 1フレームあたりの移動量 `(dx, dy)`
+    :param int brightness: 明るさ `(0-255)`
+    :param int width: 線の太さ
+    """
+    def __init__(self, start_frame: int, frames: int,
+                 start: typing.Tuple[float, float],
+                 velocity: typing.Tuple[float, float],
+                 brightness: int, width: int):
+        self.start_frame = start_frame
+        self.frames = frames
+        self.start = start
+        self.velocity = velocity
+        self.brightness = brightness
+        self.width = width
+
+    @property
+    def end_frame(self) -> int:
+        return self.start_frame + self.frames
+
+    def position(self, t: float) -> typing.Tuple[float, float]:
+        return (self.start[0] + self.velocity[0] * t,
+                self.start[1] + self.velocity[1] * t)
+
+    def segment(self, frame: int) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+        """
+        指定フレームで流星が描く線分
+        :param int frame: フレーム番号
+        :return: `(x1, y1, x2, y2)` or None
+        """
+        if frame < self.start_frame or frame >= self.end_frame:
+            return None
+        t = frame - self.start_frame
+        x1, y1 = self.position(t)
+        x2, y2 = self.position(t + 1)
+        return (int(x1), int(y1), int(x2), int(y2))
+
+    def bounding_rect(self) -> typing.Tuple[int, int, int, int]:
+        x1, y1 = self.position(0)
+        x2, y2 = self.position(self.frames)
+        left = int(min(x1, x2))
+        top = int(min(y1, y2))
+        return (left, top,
+                int(abs(x2 - x1)) + 1, int(abs(y2 - y1)) + 1)
+
+    def to_dict(self) -> dict:
+        return {
+            'start_frame': self.start_frame,
+            'end_frame': self.end_frame,
+            'rect': list(self.bounding_rect()),
+            'brightness': self.brightness,
+        }
+
+
+class SyntheticSky:
+    """
+    流星・ノイズ・月明かり・雲を含む星空動画の合成
+
+        sky = SyntheticSky(1920, 1080, fps=30, frames=300, meteors=5)
+        sky.write_video("synthetic.mov")
+
+    :param int width: 幅
+    :param int height: 高さ
+    :param float fps: フレームレート
+    :param int frames: フレーム数
+    :param int stars: 星の数
+    :param int meteors: 流星の数
+    :param float noise: ノイズの標準偏差
+    :param bool moon: 月明かりを入れるか
+    :param bool clouds: 流れる雲を入れるか
+    :param int seed: 乱数のシード
+    """
+    def __init__(self, width: int, height: int, fps: float = 30,
+                 frames: int = 300, stars: int = 1000, meteors: int = 5,
+                 noise: float = 3.0, moon: bool = False, clouds: bool = False,
+                 seed: int = 0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frames = frames
+        self.noise = noise
+        self.clouds = clouds
+        self.rng = numpy.random.default_rng(seed)
+        self.background = self._make_background(stars, moon)
+        self.cloud_texture = self._make_clouds() if clouds else None
+        self.meteors = self._make_meteors(meteors)
+
+    def _make_background(self, stars: int, moon: bool) -> numpy.array:
+        rng = self.rng
+        img = numpy.full((self.height, self.width), 8, dtype=numpy.float32)
+        xs = rng.integers(0, self.width, stars)
+        ys = rng.integers(0, self.height, stars)
+        # 暗い星ほど多くなるようにする
+        values = 40 + 215 * rng.power(0.3, stars)
+        img[ys, xs] = values
+        img = cv2.GaussianBlur(img, (0, 0), 0.8)
+        img[ys, xs] = numpy.maximum(img[ys, xs], values * 0.6)
+        if moon:
+            r = max(self.width, self.height) // 40
+            cx = int(self.width * 0.8)
+            cy = int(self.height * 0.2)
+            y, x = numpy.ogrid[:self.height, :self.width]
+            d = numpy.sqrt((x - cx) ** 2 + (y - cy) ** 2, dtype=numpy.float32)
+            # 月の周りのにじみ
+            img += 80.0 * numpy.exp(-d / (r * 2.0))
+            cv2.circle(img, (cx, cy), r, 250.0, -1)
+        return numpy.clip(img, 0, 255).astype(numpy.uint8)
+
+    def _make_clouds(self) -> numpy.array:
+        # 低解像度の乱数を拡大して滑らかな雲の模様にする
+        small = self.rng.random((self.height // 64 + 2,
+                                 (self.width * 2) // 64 + 2),
+                                dtype=numpy.float32)
+        texture = cv2.resize(small, (self.width * 2, self.height),
+                             interpolation=cv2.INTER_CUBIC)
+        texture = numpy.clip((texture - 0.5) * 40, 0, 12)
+        return texture.astype(numpy.uint8)
+
+    def _make_meteors(self, count: int) -> typing.List[Meteor]:
+        rng = self.rng
+        meteors = []
+        for i in range(count):
+            frames = int(rng.integers(4, 16))
+            start_frame = int(rng.integers(0, max(self.frames - frames, 1)))
+            speed = float(rng.uniform(8, 30)) * self.width / 1920
+            angle = float(rng.uniform(0, 2 * math.pi))
+            velocity = (speed * math.cos(angle), speed * math.sin(angle))
+            length = speed * frames
+            # 画面内に収まる出現位置
+            margin = int(length) + 1
+            x = float(rng.integers(min(margin, self.width // 2),
+                                   max(self.width - margin, self.width // 2 + 1)))
+            y = float(rng.integers(min(margin, self.height // 2),
+                                   max(self.height - margin, self.height // 2 + 1)))
+            meteors.append(Meteor(start_frame, frames, (x, y), velocity,
+                                  int(rng.integers(120, 256)),
+                                  int(rng.integers(1, 4))))
+        meteors.sort(key=lambda m: m.start_frame)
+        return meteors
+
+    def frame(self, i: int, dst: typing.Optional[numpy.array] = None) -> numpy.array:
+        """
+        i 番目のフレームの生成
+        :param int i: フレーム番号
+        :param numpy.array dst: 出力先バッファ（BGR）
+        :return: フレーム画像（BGR）
+        """
+        gray = self.background.copy()
+        if self.cloud_texture is not None:
+            offset = i % self.width
+            cloud = self.cloud_texture[:, offset : offset + self.width]
+            cv2.add(gray, cloud, dst=gray)
+        if self.noise > 0:
+            noise = numpy.empty(gray.shape, dtype=numpy.int16)
+            cv2.randn(noise, 0, self.noise)
+            gray = numpy.clip(gray + noise, 0, 255).astype(numpy.uint8)
+        for m in self.meteors:
+            seg = m.segment(i)
+            if seg is not None:
+                x1, y1, x2, y2 = seg
+                cv2.line(gray, (x1, y1), (x2, y2), m.brightness, m.width,
+                         cv2.LINE_AA)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=dst)
+
+    def write_video(self, path: str,
+                    creation_time: typing.Optional[datetime.datetime] = None,
+                    vcodec: str = 'mjpeg'):
+        """
+        動画ファイルの書き出し（ffmpeg を使用）
+        `creation_time` は detect_meteor.py / make_digest_movie.py が参照するメタデータとして書き込む
+        :param str path: 出力ファイルパス
+        :param creation_time: 撮影開始日時（None の場合は現在時刻）
+        :param str vcodec: ffmpeg のエンコーダ名
+        :return: 書き込んだ `creation_time` の文字列
+        """
+        if creation_time is None:
+            creation_time = datetime.datetime.now(datetime.timezone.utc)
+        ct = creation_time.strftime('%Y-%m-%dT%H:%M:%S.000000Z')
+        process = (
+            ffmpeg
+            .input('pipe:', format='rawvideo', pix_fmt='bgr24',
+                   s='{}x{}'.format(self.width, self.height),
+                   framerate=self.fps)
+            .output(path, vcodec=vcodec, pix_fmt='yuvj420p', qscale=2,
+                    metadata='creation_time=' + ct)
+            .overwrite_output()
+            .global_args('-loglevel', 'error')
+            .run_async(pipe_stdin=True)
+        )
+        buf = None
+        for i in range(self.frames):
+            buf = self.frame(i, buf)
+            process.stdin.write(buf.tobytes())
+        process.stdin.close()
+        process.wait()
+        return ct
+
+    def ground_truth(self) -> dict:
+        return {
+            'width': self.width,
+            'height': self.height,
+            'fps': self.fps,
+            'frames': self.frames,
+            'meteors': [m.to_dict() for m in self.meteors],
+        }
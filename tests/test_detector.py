@@ -0,0 +1,89 @@
+import cv2
+import numpy
+
+import detector
+import synthetic
+
+def stacked_frames(sky):
+    # フレームのノイズは呼び出し毎に変わるので、一度だけ合成して使い回す
+    stacker = detector.FrameStacker(5)
+    result = []
+    for i in range(sky.frames):
+        stacker.push(cv2.cvtColor(sky.frame(i), cv2.COLOR_BGR2GRAY))
+        if stacker.count == stacker.stack_size:
+            result.append((i, stacker.stacked().copy()))
+    return result
+
+
+def detected_frames(frames, **kwargs):
+    meteor_detector = detector.Detector(**kwargs)
+    result = {}
+    for i, img in frames:
+        lines, _ = meteor_detector.process(img)
+        if lines is not None:
+            result[i] = sorted(tuple(line[0]) for line in lines)
+    return result
+
+
+def test_strips_detect_same_frames_as_full_frame():
+    sky = synthetic.SyntheticSky(640, 360, fps=30, frames=60, stars=300,
+                                 meteors=5, moon=True, seed=0)
+    frames = stacked_frames(sky)
+    for params in (detector.DetectorParams(),
+                   detector.DetectorParams(area_threshold=0.0005,
+                                           area_value_threshold=60)):
+        full = detected_frames(frames, params=params)
+        assert full
+        for rows in (64, 100):
+            assert detected_frames(frames, params=params,
+                                   strip_rows=rows) == full
+
+
+def test_hough_strips_join_lines_across_boundaries():
+    img = numpy.zeros((2000, 3000), dtype=numpy.uint8)
+    cv2.line(img, (100, 100), (2900, 1900), 200, 1)
+    length = numpy.hypot(2800, 1800)
+    full = detector.Detector(detector.DetectorParams())
+    full_lines, _, _ = full.find_lines(img)
+    longest = max(detector.line_length(line) for line in full_lines)
+    for rows in (64, 128, 300):
+        strips = detector.Detector(detector.DetectorParams(), strip_rows=rows,
+                                   hough_strips=True)
+        lines, _, _ = strips.find_lines(img)
+        lengths = [detector.line_length(line) for line in lines]
+        # 境界で切れた線分が残らず、重なりで二重に検出された線分もない
+        assert max(lengths) >= longest
+        assert len(lines) <= len(full_lines)
+        assert sum(lengths) <= length + 1
+
+
+def test_merge_strip_lines():
+    # 境界（100-130行目が重なり）をまたぐ直線と、重なりで両方から検出された線分
+    strips = [
+        (0, 130, numpy.array([[[10, 40, 110, 120]], [[300, 110, 360, 125]]],
+                             dtype=numpy.int32)),
+        (100, 230, numpy.array([[[85, 100, 210, 200]], [[300, 110, 360, 125]]],
+                               dtype=numpy.int32)),
+    ]
+    lines = detector.merge_strip_lines(strips, max_gap=5)
+    assert sorted(tuple(line[0]) for line in lines) == \
+        [(10, 40, 210, 200), (300, 110, 360, 125)]
+
+
+def test_area_reuse_redetects_on_scene_change():
+    # 途中のフレームから月（明るい円）が現れる
+    rng = numpy.random.default_rng(0)
+    frames = []
+    for i in range(20):
+        img = rng.integers(10, 30, (360, 640), dtype=numpy.uint8)
+        if i >= 7:
+            cv2.circle(img, (400, 150), 30, 230, -1)
+        frames.append(img)
+    params = detector.DetectorParams(area_threshold=0.001,
+                                     area_value_threshold=127)
+    every = detector.Detector(params)
+    expected = [every.detect_areas(img)[0] for img in frames]
+    assert not expected[6] and expected[7]
+    params.area_reuse_frames = 100
+    reuse = detector.Detector(params)
+    assert [reuse.detect_areas(img)[0] for img in frames] == expected
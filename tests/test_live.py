@@ -0,0 +1,73 @@
+import datetime
+import glob
+import os
+
+import detect_meteor_live
+import livesource
+import resultstore
+import synthetic
+
+FPS = 30.0
+START = datetime.datetime(2021, 12, 14, 2, 14, 57)
+
+class SyntheticSource:
+    """
+    合成した星空のフレームを既知の時刻で返す取り込み元
+    """
+    def __init__(self, sky: synthetic.SyntheticSky):
+        self.sky = sky
+        self.fps = sky.fps
+        self.name = "synthetic"
+        self.live = False
+        self.index = 0
+
+    def read(self):
+        if self.index >= self.sky.frames:
+            return None
+        t = START + datetime.timedelta(seconds=self.index / self.fps)
+        frame = livesource.Frame(self.sky.frame(self.index), t, self.name)
+        self.index += 1
+        return frame
+
+    def release(self):
+        pass
+
+
+def run_live(tmp_path, sky, **values):
+    values.setdefault("output_directory", str(tmp_path))
+    values.setdefault("disable_clip", True)
+    conf = detect_meteor_live.SCHEMA.resolve(values)
+    detect_meteor_live.detect_live(SyntheticSource(sky), conf)
+    result_files = glob.glob(os.path.join(str(tmp_path), "result_live_*.jsonl"))
+    assert len(result_files) == 1
+    return resultstore.load_json(result_files[0]), result_files[0]
+
+
+def test_archived_timestamps_equal_frame_times(tmp_path):
+    sky = synthetic.SyntheticSky(640, 360, fps=FPS, frames=60, stars=200,
+                                 meteors=3, seed=1)
+    entries, result_file = run_live(tmp_path, sky)
+    assert entries
+    store = resultstore.load(result_file)
+    timestamps = sorted(store.detections['timestamp'].astype(datetime.datetime))
+    # 合成した最初のフレームの時刻（フレーム番号から求める）
+    expected = sorted(START + datetime.timedelta(seconds=e['frame'] / FPS)
+                      for e in entries)
+    assert timestamps == expected
+    for e in entries:
+        assert e['creation_time'] == START.isoformat()
+
+
+def test_dropped_frames_advance_frame_numbers():
+    sky = synthetic.SyntheticSky(64, 48, fps=FPS, frames=10, stars=10,
+                                 meteors=0)
+    source = SyntheticSource(sky)
+    source.live = True
+    queue = livesource.FrameQueue(2, "drop")
+    capture = livesource.CaptureThread(source, queue)
+    # 取り出さずに最後まで取り込むと、古いフレームは捨てられる
+    capture.run()
+    frames = [queue.get(timeout=0) for i in range(2)]
+    assert [f.number for f in frames] == [8, 9]
+    assert [f.time for f in frames] == \
+        [START + datetime.timedelta(seconds=n / FPS) for n in (8, 9)]
@@ -0,0 +1,34 @@
+import os
+import socketserver
+import stat
+
+import pytest
+
+import smd
+
+class RecordingJobServer(smd.JobServer):
+    """
+    bind() の直後（接続を受け付け始める時点）のソケットファイルの権限を記録するサーバー
+    """
+    def server_activate(self):
+        self.activated_mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        super().server_activate()
+
+@pytest.mark.skipif(not hasattr(socketserver, "UnixStreamServer"),
+                    reason="Unix ドメインソケットが使えない")
+def test_socket_is_created_private(tmp_path):
+    """
+    ソケットファイルが作成された時点から所有者だけに読み書きでき、umask が元に戻ること
+    """
+    path = str(tmp_path / "smd.sock")
+    old = os.umask(0o022)
+    try:
+        server = RecordingJobServer(path)
+        try:
+            assert server.activated_mode == 0o600
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        finally:
+            server.server_close()
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(old)
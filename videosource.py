@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import fractions
+import re
+import sys
+import threading
+import typing
+
+from lazyimport import lazy_import
+cv2 = lazy_import('cv2')
+numpy = lazy_import('numpy')
+ffmpeg = lazy_import('ffmpeg')
+
+DECODERS = ("opencv", "ffmpeg")
+
+# ffmpeg の showinfo フィルタが出力するフレーム毎の情報
+SHOWINFO_PATTERN = re.compile(r"\[Parsed_showinfo_\d+ @ [^\]]*\] \[info\] n:\s*(\d+) .*pts_time:(\S+)")
+# showinfo の出力を待つ最大時間[秒]
+PTS_TIMEOUT = 5.0
+# `-loglevel level+info` で各行に付くログレベルのうち、表示するもの
+FFMPEG_ERROR_PATTERN = re.compile(r"(\[[^\]]* @ [^\]]*\] )?\[(error|fatal|panic)\]")
+
+class VideoInfo:
+    """
+    動画ファイルの情報（`ffmpeg.probe()` の結果から必要なものだけを取り出したもの）
+    """
+    def __init__(self, probe_result: dict):
+        stream = None
+        for s in probe_result['streams']:
+            if s.get('codec_type', 'video') == 'video':
+                stream = s
+                break
+        if stream is None:
+            stream = probe_result['streams'][0]
+        self.creation_time = stream.get('tags', {}).get('creation_time')
+        if self.creation_time is None:
+            format_tags = probe_result.get('format', {}).get('tags', {})
+            self.creation_time = format_tags.get('creation_time')
+        self.width = int(stream.get('width', 0))
+        self.height = int(stream.get('height', 0))
+        rate = stream.get('avg_frame_rate', '0/0')
+        if rate in ('0/0', '0'):
+            rate = stream.get('r_frame_rate', '0/1')
+        self.fps = float(fractions.Fraction(rate)) if rate != '0/0' else 0.0
+        if 'nb_frames' in stream:
+            self.frame_count = int(stream['nb_frames'])
+        elif 'duration' in stream:
+            self.frame_count = int(float(stream['duration']) * self.fps)
+        else:
+            self.frame_count = 0
+
+def probe(video_file: str) -> VideoInfo:
+    """
+    動画ファイルの情報の取得
+    :param str video_file: 動画ファイルパス
+    :return: 動画ファイルの情報
+    """
+    return VideoInfo(ffmpeg.probe(video_file))
+
+
+class OpenCVDecoder:
+    """
+    `cv2.VideoCapture` によるデコード
+    グレイスケールへの変換は detector_tuner.py と同じ `COLOR_RGB2GRAY`（BGR のフレームの
+    R と B の係数が入れ替わる）なので、輝度の値は `FFmpegDecoder` と一致しない
+    :param str video_file: 動画ファイルパス
+    :param VideoInfo info: 動画ファイルの情報（None 可）
+    :param bool gray: グレイスケールで出力するか
+    :param int threads: デコードのスレッド数（0 の場合は自動、OpenCV 4.5 以降で有効）
+    :param int frame_step: 何フレーム毎に出力するか（0, frame_step, 2 * frame_step, ... 番目。
+                           間のフレームも読み飛ばすためにデコードはされる）
+    """
+    def __init__(self, video_file: str, info: typing.Optional[VideoInfo] = None,
+                 gray: bool = True, threads: int = 0, frame_step: int = 1):
+        if threads > 0 and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+            self.cap = cv2.VideoCapture(video_file, cv2.CAP_ANY,
+                                        [cv2.CAP_PROP_N_THREADS, threads])
+        else:
+            self.cap = cv2.VideoCapture(video_file)
+        self.info = info
+        self.gray = gray
+        self.frame_step = frame_step
+        self.timestamp = 0.0
+        self._frame = None
+
+    def read(self, dst: typing.Optional[numpy.array] = None) -> typing.Optional[numpy.array]:
+        """
+        次のフレームの読み込み
+        :param numpy.array dst: 出力先バッファ
+        :return: フレーム画像（終端の場合は None）
+        """
+        result, frame = self.cap.read(self._frame)
+        if not result:
+            return None
+        self._frame = frame
+        self.timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        # 次に出力するフレームまで読み飛ばす（終端に達した場合は次の read() で None になる）
+        for i in range(self.frame_step - 1):
+            if not self.cap.grab():
+                break
+        if self.gray:
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=dst)
+        if dst is not None:
+            numpy.copyto(dst, frame)
+            return dst
+        return frame
+
+    def release(self):
+        self.cap.release()
+
+
+class FFmpegDecoder:
+    """
+    ffmpeg のサブプロセスによるデコード
+    ffmpeg から無圧縮のフレームを受け取り、出力先バッファに直接読み込む
+    グレイスケールの場合は輝度(Y)だけを受け取るので、BGR への変換とグレイスケール化を省略できる
+    タイムスタンプは showinfo フィルタが標準エラー出力に書き出す各フレームの pts_time を
+    最初のフレームからの時間にしたもの（可変フレームレートの動画でも `OpenCVDecoder` と
+    同じく実際の再生時間になる）。取得できない場合はフレーム番号とフレームレートから求める
+    :param str video_file: 動画ファイルパス
+    :param VideoInfo info: 動画ファイルの情報
+    :param bool gray: グレイスケールで出力するか
+    :param int threads: デコードのスレッド数（0 の場合は自動）
+    :param int frame_step: 何フレーム毎に出力するか（0, frame_step, 2 * frame_step, ... 番目。
+                           select フィルタで選ぶので間のフレームもデコードはされる）
+    """
+    def __init__(self, video_file: str, info: VideoInfo, gray: bool = True,
+                 threads: int = 0, frame_step: int = 1):
+        self.info = info
+        self.gray = gray
+        self.frame_step = frame_step
+        self.timestamp = 0.0
+        self.index = -1
+        if gray:
+            self.shape = (info.height, info.width)
+            pix_fmt = 'gray'
+        else:
+            self.shape = (info.height, info.width, 3)
+            pix_fmt = 'bgr24'
+        self.frame_bytes = int(numpy.prod(self.shape))
+        stream = ffmpeg.input(video_file, threads=threads)
+        if frame_step > 1:
+            stream = stream.filter('select',
+                                   'not(mod(n,{}))'.format(frame_step))
+        stream = stream.filter('showinfo')
+        self.process = (
+            stream
+            .output('pipe:', format='rawvideo', pix_fmt=pix_fmt, vsync=0)
+            # showinfo の出力は info レベルなので、行頭のレベルでエラーと区別する
+            .global_args('-loglevel', 'level+info', '-hide_banner', '-nostats',
+                         '-nostdin')
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+        self._frame = None
+        self._pts = {}
+        self._pts_cond = threading.Condition()
+        self._pts_closed = False
+        self._first_pts = None
+        self._stderr_thread = threading.Thread(target=self._read_stderr,
+                                               daemon=True)
+        self._stderr_thread.start()
+
+    def _read_stderr(self):
+        """
+        標準エラー出力の読み込み（別スレッド）
+        各フレームの pts_time を取り出し、エラーはそのまま表示する
+        """
+        try:
+            for raw in self.process.stderr:
+                line = raw.decode('utf-8', 'replace').rstrip()
+                m = SHOWINFO_PATTERN.search(line)
+                if m:
+                    try:
+                        pts = float(m.group(2))
+                    except ValueError:
+                        continue
+                    with self._pts_cond:
+                        self._pts[int(m.group(1))] = pts
+                        self._pts_cond.notify_all()
+                elif FFMPEG_ERROR_PATTERN.match(line):
+                    print(line, file=sys.stderr)
+        finally:
+            with self._pts_cond:
+                self._pts_closed = True
+                self._pts_cond.notify_all()
+
+    def _frame_pts(self, n: int) -> typing.Optional[float]:
+        """
+        n 番目（0 始まり）に出力されたフレームの pts_time の取得
+        showinfo の行はフレームがパイプに書き出される前に出力されるので、読み込みスレッドが
+        追いつくまで待つ。行を取りこぼした場合に ffmpeg と待ち合わせにならないよう、待ち時間は区切る
+        :param int n: 出力フレームの番号
+        :return: pts_time[秒]、取得できなかった場合は None
+        """
+        with self._pts_cond:
+            self._pts_cond.wait_for(lambda: n in self._pts or self._pts_closed,
+                                    timeout=PTS_TIMEOUT)
+            pts = self._pts.pop(n, None)
+            for k in [k for k in self._pts if k < n]:
+                del self._pts[k]
+            return pts
+
+    def read(self, dst: typing.Optional[numpy.array] = None) -> typing.Optional[numpy.array]:
+        """
+        次のフレームの読み込み
+        :param numpy.array dst: 出力先バッファ（C 連続であること）
+        :return: フレーム画像（終端の場合は None）
+        """
+        if dst is None:
+            if self._frame is None:
+                self._frame = numpy.empty(self.shape, dtype=numpy.uint8)
+            dst = self._frame
+        view = memoryview(dst.reshape(-1))
+        n = 0
+        while n < self.frame_bytes:
+            r = self.process.stdout.readinto(view[n:])
+            if not r:
+                return None
+            n += r
+        self.index += 1
+        pts = self._frame_pts(self.index)
+        if pts is not None:
+            if self._first_pts is None:
+                self._first_pts = pts
+            # `CAP_PROP_POS_MSEC` と同じくストリームの先頭からの時間
+            self.timestamp = (pts - self._first_pts) * 1000
+        elif self.info.fps > 0:
+            self.timestamp = self.index * self.frame_step * 1000 / self.info.fps
+        return dst
+
+    def release(self):
+        self.process.stdout.close()
+        self.process.terminate()
+        self.process.wait()
+        self._stderr_thread.join(timeout=5.0)
+
+
+def open_decoder(video_file: str, decoder: str = "opencv",
+                 info: typing.Optional[VideoInfo] = None, **kwargs):
+    """
+    デコーダの作成
+    :param str video_file: 動画ファイルパス
+    :param str decoder: `opencv` または `ffmpeg`
+    :param VideoInfo info: 動画ファイルの情報（ffmpeg で None の場合は取得する）
+    :return: デコーダ
+    """
+    if decoder == "ffmpeg":
+        if info is None:
+            info = probe(video_file)
+        return FFmpegDecoder(video_file, info, **kwargs)
+    elif decoder == "opencv":
+        return OpenCVDecoder(video_file, info, **kwargs)
+    raise ValueError("unknown decoder: " + decoder)